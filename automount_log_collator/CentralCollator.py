@@ -0,0 +1,223 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import multiprocessing
+import os
+import os.path
+import queue
+import sys
+import zlib
+
+from .Collator import Collator
+from .HistoryAppender import HistoryAppender
+from .Metrics import Metrics
+from .util import timestamp_str, timestamp_from_str
+
+def host_partition(host, n):
+    """Return which of n partitions host belongs to, which is stable across runs."""
+    return zlib.crc32(host.encode()) % n
+
+class HostCollators(object):
+    """The Collators for the hosts of one partition, created as their events arrive.
+    They share a HistoryAppender, so the history files held open are bounded for
+    the partition as a whole, however many hosts there are."""
+
+    def __init__(self, config, verbose, metrics):
+        self._config = config
+        self._verbose = verbose
+        self._metrics = metrics
+        self._history = HistoryAppender()
+        self._collators = {}
+
+    def collate(self, batch):
+        """Collate a batch of events, as (action, t, path, host) tuples."""
+        for action, t, path, host in batch:
+            collator = self._collators.get(host)
+            if collator is None:
+                collator = self._collators[host] = Collator(self._config, self._verbose, self._metrics, host, self._history)
+            if action == 'mounted':
+                collator.mount(t, path)
+            elif action == 'expired':
+                collator.unmount(t, path)
+
+    def finalize(self):
+        for collator in self._collators.values():
+            collator.finalize()
+
+def collate_partition(config, verbose, batches, results):
+    """Collate the batches of events for a partition of hosts from the batches queue,
+    in a worker process.  A batch of None is a request to finalize, after which
+    the counters since the last finalize are put on the results queue, and a
+    batch of False is the end."""
+    metrics = Metrics('collate')
+    collators = HostCollators(config, verbose, metrics)
+    for batch in iter(batches.get, False):
+        if batch is None:
+            collators.finalize()
+            results.put(dict(metrics.counters))
+            metrics.counters = dict.fromkeys(metrics.counter_names, 0)
+        else:
+            collators.collate(batch)
+
+class CentralCollator(object):
+    """Collates aggregated logfiles from many hosts, as written by a central syslog
+    server, routing each event by its syslog hostname to the Collator for that
+    host, which has its own last collation and active mounts, just as if the host
+    collated its own logfile, except that its mounts can't be checked.
+
+    With more than one job, hosts are partitioned by hostname across worker
+    processes, each holding the Collators for its hosts, and events are sent to
+    them in batches.  Each host's events stay in order, as a host is always in
+    the same partition.
+
+    The last collation for the aggregated logfiles as a whole, and the live
+    logfile checkpoint, are kept separately, in the central collation file."""
+
+    batchsize = 1000
+
+    def __init__(self, config, verbose, metrics, jobs):
+        self._config = config
+        self._verbose = verbose
+        self.metrics = metrics
+        self._last_collation = None
+        self._pending_after = None
+        self._last_path = None
+        self._logfile_checkpoint = None
+        self._logfile_checkpoint_changed = False
+        self._load()
+        if jobs > 1:
+            self._results = multiprocessing.Queue()
+            self._workers = []
+            for i in range(jobs):
+                batches = multiprocessing.Queue(maxsize=16)
+                worker = multiprocessing.Process(target=collate_partition, args=(config, verbose, batches, self._results), daemon=True)
+                worker.start()
+                self._workers.append((worker, batches))
+            self._batches = [ [] for worker in self._workers ]
+            self._local = None
+        else:
+            self._workers = []
+            self._batches = [ [] ]
+            self._local = HostCollators(config, verbose, metrics)
+
+    def _load(self):
+        # same format as for a single host
+        try:
+            with open(self._config.central_collation_file) as f:
+                lines = f.read().splitlines()
+                self._last_collation = timestamp_from_str(lines[0])
+                self._pending_after = self._last_collation
+                if self._verbose:
+                    sys.stdout.write('last central collation at %s\n' % timestamp_str(self._last_collation))
+                if len(lines) > 1:
+                    fields = lines[1].split()
+                    if len(fields) == 4 and fields[0] == 'logfile':
+                        self._logfile_checkpoint = tuple(int(x) for x in fields[1:])
+        except (IOError, ValueError, IndexError):
+            pass
+
+    def _save(self):
+        central_collation_file = self._config.central_collation_file
+        os.makedirs(os.path.dirname(central_collation_file), exist_ok=True)
+        with open(central_collation_file, 'w') as f:
+            f.write('%s\n' % timestamp_str(self._last_collation))
+            if self._logfile_checkpoint is not None:
+                f.write('logfile %d %d %d\n' % self._logfile_checkpoint)
+        self._logfile_checkpoint_changed = False
+
+    def last_collation(self):
+        """Return the timestamp of the last collated record, or None."""
+        return self._last_collation
+
+    def logfile_checkpoint(self):
+        """Return (inode, size, offset) for how far the live logfile was processed, or None."""
+        return self._logfile_checkpoint
+
+    def set_logfile_checkpoint(self, inode, size, offset):
+        """Record how far the live logfile has been processed, to be saved on finalize."""
+        if self._logfile_checkpoint != (inode, size, offset):
+            self._logfile_checkpoint = (inode, size, offset)
+            self._logfile_checkpoint_changed = True
+
+    def pending(self, t0):
+        """Return whether records at time t0 may still be processed, though each host's
+        Collator decides that for itself."""
+        return self._pending_after is None or t0 > self._pending_after
+
+    def _send(self, i):
+        batch = self._batches[i]
+        self._batches[i] = []
+        if self._local is not None:
+            self._local.collate(batch)
+            return
+        worker, batches = self._workers[i]
+        while True:
+            try:
+                batches.put(batch, timeout=1)
+                return
+            except queue.Full:
+                if not worker.is_alive():
+                    raise RuntimeError('collation worker for host partition %d failed' % i)
+
+    def collate(self, events):
+        """Route the events to their hosts' Collators, returning how many there were."""
+        n = 0
+        n_partitions = len(self._batches)
+        for event in events:
+            # hosts are known by their bare names, as when collating their own logfiles
+            host = event.host.split('.', 1)[0]
+            i = host_partition(host, n_partitions) if n_partitions > 1 else 0
+            batch = self._batches[i]
+            batch.append((event.action, event.t, event.path, host))
+            if len(batch) >= self.batchsize:
+                self._send(i)
+            if self._last_path is None or event.t > self._last_path:
+                self._last_path = event.t
+            n += 1
+        return n
+
+    def finalize(self):
+        """Write out the collation for all the hosts, which may nonetheless continue."""
+        with self.metrics.phase('save'):
+            for i in range(len(self._batches)):
+                self._send(i)
+            if self._local is not None:
+                self._local.finalize()
+            else:
+                for worker, batches in self._workers:
+                    batches.put(None)
+                for worker in self._workers:
+                    while True:
+                        try:
+                            counters = self._results.get(timeout=1)
+                            break
+                        except queue.Empty:
+                            if not all(worker.is_alive() for worker, batches in self._workers):
+                                raise RuntimeError('collation worker failed')
+                    for name, n in counters.items():
+                        self.metrics.count(name, n)
+            if self._last_path is not None and (self._last_collation is None or self._last_path > self._last_collation):
+                self._last_collation = self._last_path
+            if self._last_collation is not None and (self._last_path is not None or self._logfile_checkpoint_changed):
+                self._save()
+
+    def close(self):
+        """Stop the worker processes."""
+        for worker, batches in self._workers:
+            if worker.is_alive():
+                batches.put(False)
+        for worker, batches in self._workers:
+            worker.join()
+        self._workers = []
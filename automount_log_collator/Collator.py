@@ -15,105 +15,174 @@
 
 import os
 import os.path
-import pendulum
 import re
 import sys
-
-from .util import ( bare_hostname, duration_str, timestamp_str, timestamp_from_str, purge_empty_dirs,
-                    escape_path, unescape_path )
+import time
+
+from .LogStore import LogStore
+from .Metrics import Metrics
+from .SqliteStore import SqliteStore
+from .TreeStore import TreeStore
+from .util import ( bare_hostname, duration_str, timestamp_str, timestamp_from_str, read_manifest, write_manifest,
+                    read_mount_points, ismount_with_timeout )
+
+def collation_store(config, verbose, history=None):
+    """Return the collation store configured by collation-store, with history the
+    HistoryAppender for a tree store, if it is to be shared with others."""
+    if config.collation_store == 'log':
+        return LogStore(config, verbose)
+    if config.collation_store == 'sqlite':
+        return SqliteStore(config, verbose)
+    return TreeStore(config, verbose, history)
 
 class Collator(object):
-    def __init__(self, config, verbose):
+    def __init__(self, config, verbose, metrics=None, hostname=None, history=None):
         self._config = config
         self._verbose = verbose
-        self._hostname = bare_hostname()
+        self.metrics = metrics if metrics is not None else Metrics(None)
+        self._hostname = hostname if hostname is not None else bare_hostname()
         self._last_collation = None
+        self._pending_after = None      # the last collation when loaded, for pending records
         self._last_path = None
+        self._logfile_checkpoint = None # (inode, size, offset) of live logfile, as far as processed
+        self._logfile_checkpoint_changed = False
         self._mounts = {}
         self._persisted_mounts = {} # for mounts which were saved in filesystem
-        self._dirty = False     # whether we need to cleanup persisted mount directories
-        self._load()
-
-    def host_history_path(self, host, path):
-        """Return the path to the mount history file."""
-        return os.path.join(self._config.host_collation_dir(host), escape_path(path), 'history')
-
-    def _history_path(self, path):
-        """Return the path to the mount history file."""
-        return self.host_history_path(None, path)
-
-    def host_active_path(self, host, path):
-        """Return the path to the active mount file."""
-        return os.path.join(self._config.host_collation_dir(host), escape_path(path), 'active')
-
-    def _active_path(self, path):
-        """Return the path to the active mount file."""
-        return self.host_active_path(None, path)
-
-    def _path_from_mounts_filepath(self, filepath, host=None):
-        """Return the path represented by the active or history file."""
-        return os.path.dirname(unescape_path(filepath[len(self._config.host_collation_dir(host)):]))
+        self._changed_mounts = set() # mounts whose active file needs to be written
+        self._store = collation_store(config, verbose, history)
+        with self.metrics.phase('load'):
+            self._load()
 
     def _load(self):
-        # last collation timestamp
+        # last collation timestamp, optionally followed by live logfile checkpoint
         try:
-            with open(self._config.last_collation_file) as f:
-                self._last_collation = timestamp_from_str(f.read())
+            with open(self._config.last_collation_file(self._hostname)) as f:
+                lines = f.read().splitlines()
+                self._last_collation = timestamp_from_str(lines[0])
+                self._pending_after = self._last_collation
                 if self._verbose:
                     sys.stdout.write('last collation at %s\n' % timestamp_str(self._last_collation))
-        except (IOError, ValueError):
+                if len(lines) > 1:
+                    fields = lines[1].split()
+                    if len(fields) == 4 and fields[0] == 'logfile':
+                        self._logfile_checkpoint = tuple(int(x) for x in fields[1:])
+        except (IOError, ValueError, IndexError):
             pass
 
-        # active mounts
-        for root, dirs, files in os.walk(self._config.host_collation_dir()):
-            if 'active' in files:
-                # read actual file, and path for mount, and its timestamp
-                filepath = os.path.join(root, 'active')
-                path = self._path_from_mounts_filepath(filepath)
-                #if self._verbose:
-                #    sys.stdout.write('path from %s is %s\n' % (filepath, path))
-                with open(filepath, 'r') as f:
-                    for line in f:
-                        t0 = timestamp_from_str(line)
-                        self._mounts[path] = t0
-                        self._persisted_mounts[path] = True
-                        if self._verbose:
-                            sys.stdout.write('load mount %s at %s\n' % (path, t0))
+        # active mounts, from the manifest if possible, since walking the tree is expensive
+        if not self._load_manifest():
+            self._add_loaded_mounts(self._store.load_active(self._hostname))
+            if os.path.isdir(self._config.collation_dir()):
+                self._save_manifest()
+
+    def host_active_manifest(self, host):
+        """Return the set of active mount paths for host, and the time they were last
+        confirmed as in use, from its manifest, or None if there is no valid manifest."""
+        try:
+            mounts = read_manifest(self._config.active_manifest_file(host))
+            return set(mounts), os.stat(self._config.active_manifest_file(host)).st_mtime
+        except (IOError, ValueError):
+            return None
+
+    def _load_manifest(self):
+        """Load active mounts from the manifest, returning whether it was found and valid."""
+        try:
+            mounts = read_manifest(self._config.active_manifest_file(self._hostname))
+        except (IOError, ValueError) as e:
+            if self._verbose and not isinstance(e, FileNotFoundError):
+                sys.stdout.write('ignoring bad manifest %s: %s\n' % (self._config.active_manifest_file(self._hostname), e))
+            return False
+        self._add_loaded_mounts(mounts)
+        return True
+
+    def _add_loaded_mounts(self, mounts):
+        for path, t0 in mounts.items():
+            self._mounts[path] = t0
+            self._persisted_mounts[path] = True
+            if self._verbose:
+                sys.stdout.write('load mount %s at %s\n' % (path, timestamp_str(t0)))
+
+    def _save_manifest(self):
+        write_manifest(self._config.active_manifest_file(self._hostname), self._mounts)
+
+    def _save_last_collation(self):
+        # the store may not have needed to create the collation directory yet
+        last_collation_file = self._config.last_collation_file(self._hostname)
+        os.makedirs(os.path.dirname(last_collation_file), exist_ok=True)
+        with open(last_collation_file, 'w') as f:
+            f.write('%s\n' % timestamp_str(self._last_collation))
+            if self._logfile_checkpoint is not None:
+                f.write('logfile %d %d %d\n' % self._logfile_checkpoint)
+        self._logfile_checkpoint_changed = False
+
+    def _bogus_mounts(self):
+        """Return the active mounts which are not in fact mounted."""
+        mount_check = self._config.mount_check
+        if mount_check == 'none' or self._hostname != bare_hostname():
+            # there's no checking the mounts of another host
+            return []
+        if mount_check == 'mountinfo':
+            # a single snapshot of the mount table, which doesn't touch the mounts themselves
+            try:
+                mount_points = read_mount_points(self._config.mountinfo_file)
+                return [ path for path in self._mounts if os.path.normpath(path) not in mount_points ]
+            except (IOError, IndexError) as e:
+                sys.stderr.write('warning: failed to read %s, falling back to ismount: %s\n' % (self._config.mountinfo_file, e))
+        bogus_mounts = []
+        for path in self._mounts:
+            mounted = ismount_with_timeout(path, self._config.ismount_timeout)
+            if mounted is None:
+                # don't stall the whole run on a hung server, just check again next time
+                sys.stderr.write('warning: timed out checking mount %s, skipping remaining mount checks\n' % path)
+                break
+            if not mounted:
+                bogus_mounts.append(path)
+        return bogus_mounts
 
     def _save(self):
         # last collation timestamp
-        with open(self._config.last_collation_file, 'w') as f:
-            f.write('%s\n' % timestamp_str(self._last_collation))
+        self._save_last_collation()
 
-        # ensure we don't persist an active mount which is not in fact mounted
-        bogus_mounts = {}
-        for path in self._mounts:
-            if not os.path.ismount(path):
-                bogus_mounts[path] = True
-        for path in bogus_mounts:
+        # ensure we don't persist an active mount which is not in fact mounted,
+        # without taking the time of discarding it as that of the last record
+        last_path = self._last_path
+        for path in self._bogus_mounts():
             if self._verbose:
                 sys.stdout.write('bogus mount %s, discarding\n' % path)
-            self.unmount(pendulum.now(), path)
-
-        # active mounts
-        now = pendulum.now().int_timestamp
-        for path, t0 in self._mounts.items():
-            active_path = self._active_path(path)
-            os.makedirs(os.path.dirname(active_path), exist_ok=True)
-            with open(active_path, 'w') as f:
-                f.write('%s\n' % timestamp_str(t0))
-                if self._verbose:
-                    sys.stdout.write('save mount %s at %s\n' % (path, t0))
-            # set timestamp of collated file to now, to indicate that it is still in use
-            history_path = self._history_path(path)
-            if not os.path.exists(history_path):
-                # create empty file, so we can touch it
-                open(history_path, 'a').close()
-            os.utime(history_path, (now, now))
+            self.unmount(int(time.time()), path)
+        self._last_path = last_path
+        self._store.flush()
+
+        # active mounts; rewriting the manifest also marks them as still in use,
+        # so only new or changed mounts need saving by the store
+        self._save_manifest()
+        self.metrics.count('files_rewritten',
+                           self._store.save_active({ path: self._mounts[path] for path in self._changed_mounts },
+                                                   int(time.time()), self._hostname))
+        for path in self._changed_mounts:
+            self._persisted_mounts[path] = True
+        self._changed_mounts.clear()
+
+    def last_collation(self):
+        """Return the timestamp of the last collated record, or None."""
+        return self._last_collation
+
+    def logfile_checkpoint(self):
+        """Return (inode, size, offset) for how far the live logfile was processed, or None."""
+        return self._logfile_checkpoint
+
+    def set_logfile_checkpoint(self, inode, size, offset):
+        """Record how far the live logfile has been processed, to be saved on finalize."""
+        if self._logfile_checkpoint != (inode, size, offset):
+            self._logfile_checkpoint = (inode, size, offset)
+            self._logfile_checkpoint_changed = True
 
     def pending(self, t0):
-        """Return whether records at time t0 are still to be processed"""
-        return self._last_collation is None or t0 > self._last_collation
+        """Return whether records at time t0 are still to be processed, which is
+        relative to the last collation when loaded, so that records which follow
+        those already processed in this run are never lost, even if they have the
+        same timestamp, and even if the collation has since been saved."""
+        return self._pending_after is None or t0 > self._pending_after
 
     def _seen(self, t0):
         if self._last_path is None or t0 > self._last_path:
@@ -124,6 +193,7 @@ class Collator(object):
             if self._verbose:
                 sys.stdout.write('mount %s at %s\n' % (path, timestamp_str(t0)))
             self._mounts[path] = t0
+            self._changed_mounts.add(path)
             self._seen(t0)
 
     def _resolve_active_mount(self, path):
@@ -132,14 +202,10 @@ class Collator(object):
         #    sys.stdout.write('remove active mount %s\n' % path)
         t0 = self._mounts[path]
         del self._mounts[path]
+        self._changed_mounts.discard(path)
         if path in self._persisted_mounts:
             del self._persisted_mounts[path]
-            active_path = self._active_path(path)
-            if os.path.exists(active_path):
-                if self._verbose:
-                    sys.stdout.write('remove active mount file %s\n' % path)
-                os.remove(active_path)
-                self._dirty = True
+            self._store.remove_active(path, self._hostname)
         return t0
 
     def unmount(self, t1, path):
@@ -153,37 +219,26 @@ class Collator(object):
                 d = 'unknown'
                 if self._verbose:
                     sys.stderr.write('warning: no mount found for unmount %s at %s\n' % (path, timestamp_str(t1)))
-            history_path = self._history_path(path)
-            if not os.path.exists(history_path):
-                os.makedirs(os.path.dirname(history_path), exist_ok=True)
-            with open(history_path, 'a') as outf:
-                outf.write('%s %s %s\n' % (timestamp_str(t1), self._hostname, d))
-            t = t1.int_timestamp
-            os.utime(history_path, (t, t))
+            self._store.append(path, t1, self._hostname, d)
+            self.metrics.count('history_appends')
 
             self._seen(t1)
 
-    def purge_empty_dirs(self, host=None):
-        purge_empty_dirs(self._config.host_collation_dir(host))
-
     def finalize(self):
-        """Write out all the current mounts"""
-        if self._last_path is not None:
-            if self._last_collation is None or self._last_path > self._last_collation:
-                self._last_collation = self._last_path
-            self._save()
-        # remove any empty directories among the persisted mounts, if we deleted anything
-        if self._dirty:
-            self.purge_empty_dirs()
+        """Write out all the current mounts, and close the store, which is reopened
+        if collation continues, as when following the live logfile."""
+        with self.metrics.phase('save'):
+            if self._last_path is not None:
+                if self._last_collation is None or self._last_path > self._last_collation:
+                    self._last_collation = self._last_path
+                self._save()
+            elif self._logfile_checkpoint_changed and self._last_collation is not None:
+                # no new mounts, but save how far we got through the logfile
+                self._save_last_collation()
+        with self.metrics.phase('finalize'):
+            self.metrics.count('directories_purged', self._store.close())
 
     def hosts(self):
         """Return list of hosts which have collations."""
         return [ x for x in os.listdir(self._config.collation_dir())
                  if not x.startswith('.') ]
-
-    def paths(self, host):
-        """Return collated paths for host."""
-        for root, dirs, files in os.walk(self._config.host_collation_dir(host)):
-            if 'active' in files or 'history' in files:
-                filepath = os.path.join(root, 'history')
-                yield self._path_from_mounts_filepath(filepath, host)
@@ -62,6 +62,10 @@ class Config(object):
     def _validate(self):
         if 'class' in self._config and 'all' in self._config['class']:
             raise ConfigError(self._filename, 'invalid class "all"')
+        if self.mount_check not in ['mountinfo', 'ismount', 'none']:
+            raise ConfigError(self._filename, 'invalid mount-check "%s"' % self.mount_check)
+        if self.collation_store not in ['tree', 'log', 'sqlite']:
+            raise ConfigError(self._filename, 'invalid collation-store "%s"' % self.collation_store)
 
     def collation_dir(self):
         return expand(self._config['collation-dir'])
@@ -74,10 +78,49 @@ class Config(object):
     def consolidation_dir(self):
         return expand(self._config['consolidation-dir'])
 
+    def last_collation_file(self, host=None):
+        if host == None:
+            host = bare_hostname()
+        return os.path.join(expand(self._config['collation-dir']), '.%s.collated' % host)
+
     @property
-    def last_collation_file(self):
-        return os.path.join(expand(self._config['collation-dir']), '.%s.collated' % bare_hostname())
+    def central_collation_file(self):
+        """The last collation of aggregated logfiles from many hosts, by this host."""
+        return os.path.join(expand(self._config['collation-dir']), '.%s.central' % bare_hostname())
+
+    @property
+    def stats_cache_file(self):
+        return os.path.join(self.consolidation_dir(), '.stats')
+
+    def active_manifest_file(self, host=None):
+        if host == None:
+            host = bare_hostname()
+        return os.path.join(expand(self._config['collation-dir']), '.%s.active' % host)
 
     @property
     def logdir(self):
         return expand(self._config['log-dir'])
+
+    @property
+    def collation_store(self):
+        """How collated mounts are stored, either a directory tree or a log per host, or an SQLite database."""
+        return self._config.get('collation-store', 'tree')
+
+    @property
+    def collation_db(self):
+        """The SQLite database for the sqlite collation store."""
+        return expand(self._config.get('collation-db', os.path.join(self._config['collation-dir'], '.collation.db')))
+
+    @property
+    def mount_check(self):
+        """How to check whether active mounts are in fact mounted."""
+        return self._config.get('mount-check', 'mountinfo')
+
+    @property
+    def mountinfo_file(self):
+        return expand(self._config.get('mountinfo-file', '/proc/self/mountinfo'))
+
+    @property
+    def ismount_timeout(self):
+        """Seconds to wait for each mount check, when falling back to os.path.ismount."""
+        return self._config.get('ismount-timeout', 10)
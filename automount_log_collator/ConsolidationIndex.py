@@ -0,0 +1,155 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import locale
+import os
+import os.path
+import sys
+
+class IndexEntryBuilder(object):
+    """Builds the index entry for a consolidated file from the lines written to it.
+
+    An entry has the first and last keys, which are None for a file with no lines,
+    the size, and sparse offsets, which are the key and byte offset of a line at
+    least every spacing bytes."""
+
+    spacing = 65536
+
+    def __init__(self, keyfn, entry=None):
+        """Start a new entry, or continue entry for lines appended to its file."""
+        self._keyfn = keyfn
+        self._encoding = locale.getpreferredencoding(False)
+        if entry is None:
+            self._first = None
+            self._pos = 0
+            self._offsets = []
+            self._next_offset = 0
+        else:
+            self._first = entry['first']
+            self._pos = entry['size']
+            self._offsets = [ list(x) for x in entry['offsets'] ]
+            self._next_offset = self._offsets[-1][1] + self.spacing if self._offsets else 0
+        self._last = entry['last'] if entry is not None else None
+        self._last_line = None  # the last key is only needed at the end
+
+    @classmethod
+    def scan(cls, keyfn, outpath):
+        """Return a builder for the existing consolidated file at outpath."""
+        builder = cls(keyfn)
+        with open(outpath) as f:
+            for line in f:
+                builder.add(line)
+        return builder
+
+    def add(self, line):
+        if line.strip() == '':
+            # ignore blank lines, but not their bytes
+            self._pos += len(line.encode(self._encoding))
+            return
+        if self._pos >= self._next_offset or self._first is None:
+            key = self._keyfn(line)
+            if self._first is None:
+                self._first = key
+            if self._pos >= self._next_offset:
+                self._offsets.append([key, self._pos])
+                self._next_offset = self._pos + self.spacing
+        self._last_line = line
+        self._pos += len(line.encode(self._encoding))
+
+    def entry(self):
+        """Return the entry for the lines added."""
+        if self._last_line is not None:
+            self._last = self._keyfn(self._last_line)
+            self._last_line = None
+        return { 'first': self._first, 'last': self._last, 'size': self._pos, 'offsets': self._offsets }
+
+class ConsolidationIndex(object):
+    """The index of consolidated files, kept in <consolidation-dir>/.index, as a
+    JSON line for each mount path with its index entry, so that queries can skip
+    files outside a time range, and seek to the right part of those within it."""
+
+    def __init__(self, consolidation_dir):
+        self._consolidation_dir = consolidation_dir
+        self._path = os.path.join(consolidation_dir, '.index')
+        self.entries = {}       # mount path -> entry
+
+    def load(self):
+        """Load the index, returning whether it was found and valid."""
+        try:
+            entries = {}
+            with open(self._path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    entries[record.pop('path')] = record
+            self.entries = entries
+            return True
+        except (IOError, ValueError, KeyError):
+            return False
+
+    def save(self):
+        """Atomically replace the index."""
+        path_new = '%s.new' % self._path
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with open(path_new, 'w') as f:
+            for path, entry in sorted(self.entries.items()):
+                record = { 'path': path }
+                record.update(entry)
+                f.write('%s\n' % json.dumps(record, sort_keys=True))
+        os.rename(path_new, self._path)
+
+    def _walk(self):
+        """Generate the mount path and file path of every consolidated file."""
+        for root, dirs, files in os.walk(self._consolidation_dir):
+            for filename in files:
+                if not filename.startswith('.'):
+                    outpath = os.path.join(root, filename)
+                    yield os.sep + os.path.relpath(outpath, self._consolidation_dir), outpath
+
+    def scan(self, keyfn):
+        """Add an entry for every consolidated file without one, by reading it, so that
+        an index which didn't load, and is saved after this, covers all the files."""
+        for path, outpath in self._walk():
+            if path not in self.entries:
+                self.entries[path] = IndexEntryBuilder.scan(keyfn, outpath).entry()
+
+    def consolidated_paths(self):
+        """Return the consolidated mount paths in order, from the index if it loads,
+        otherwise by walking the consolidation directory."""
+        if self.load():
+            return sorted(self.entries)
+        sys.stderr.write('warning: no consolidation index, scanning all files\n')
+        return sorted(path for path, outpath in self._walk())
+
+    def valid_entry(self, path, outpath):
+        """Return the entry for path if it is consistent with the consolidated file at outpath, otherwise None."""
+        entry = self.entries.get(path)
+        try:
+            if entry is not None and entry['size'] == os.path.getsize(outpath):
+                return entry
+        except OSError:
+            pass
+        return None
+
+    @staticmethod
+    def seek_offset(entry, key):
+        """Return the offset from which to read lines with keys from key onwards."""
+        offset = 0
+        for offset_key, pos in entry['offsets']:
+            # lines before pos have keys no greater than offset_key
+            if offset_key >= key:
+                break
+            offset = pos
+        return offset
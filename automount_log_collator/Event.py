@@ -0,0 +1,34 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+class Event(object):
+    """A mount event from a logfile, with action 'mounted' or 'expired', integer
+    timestamp t, and the syslog hostname, if known.  Events are created for every
+    matching log line, so are kept small."""
+
+    __slots__ = ('action', 't', 'path', 'host')
+
+    def __init__(self, action, t, path, host=None):
+        self.action = action
+        self.t = t
+        self.path = path
+        self.host = host
+
+    def __repr__(self):
+        return 'Event(%r, %d, %r, %r)' % (self.action, self.t, self.path, self.host)
+
+    def __eq__(self, other):
+        return (isinstance(other, Event) and
+                (self.action, self.t, self.path, self.host) == (other.action, other.t, other.path, other.host))
@@ -0,0 +1,164 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import locale
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import zipfile
+
+from .Collator import collation_store
+from .Config import Config
+from .ConsolidationIndex import ConsolidationIndex
+from .util import duration_seconds, timestamp_from_str
+
+class Exporter(object):
+    """Exports the consolidated history as columnar NumPy arrays, one row per
+    unmount, which are t1, the integer timestamp, duration in seconds, or -1 if
+    unknown, and host and path, which are codes into the hosts and paths arrays.
+
+    The rows are counted in a first pass, so that the arrays are written
+    through memory maps in chunks in the second, without holding the history in
+    memory.  If the history changes in between, the arrays are truncated to the
+    rows actually written.  NumPy is an optional dependency, only needed for this."""
+
+    chunksize = 65536
+
+    def __init__(self, args):
+        self._config = Config(args)
+        self._verbose = args.verbose
+        parser = argparse.ArgumentParser(prog='%s export' % os.path.basename(sys.argv[0]),
+                                         description='export consolidated mount history as NumPy arrays')
+        parser.add_argument('output', metavar='OUTPUT', help='directory for .npy files, or .npz file')
+        self._args = parser.parse_args(args.args)
+        self._encoding = locale.getpreferredencoding(False)
+
+    def _consolidated_files(self):
+        """Return the consolidated paths and their files."""
+        consolidation_dir = self._config.consolidation_dir()
+        return [ (path, os.path.join(consolidation_dir, path.lstrip(os.sep)))
+                 for path in ConsolidationIndex(consolidation_dir).consolidated_paths() ]
+
+    def _parse_line(self, rawline):
+        """Return the fields of a consolidated line, or None if it is not a row."""
+        fields = rawline.decode(self._encoding).split()
+        return fields if len(fields) >= 3 else None
+
+    def _count_file_rows(self, files):
+        n = 0
+        for path, outpath in files:
+            with open(outpath, 'rb') as f:
+                for rawline in f:
+                    if self._parse_line(rawline) is not None:
+                        n += 1
+        return n
+
+    def _file_rows(self, files):
+        """Generate path, host, t1 and duration for each consolidated line."""
+        for path, outpath in files:
+            if self._verbose:
+                sys.stdout.write('exporting %s\n' % outpath)
+            with open(outpath, 'rb') as f:
+                for rawline in f:
+                    fields = self._parse_line(rawline)
+                    if fields is not None:
+                        yield path, fields[1], timestamp_from_str(fields[0]), fields[2]
+
+    def _write_arrays(self, np, outdir, n, rows):
+        """Write the arrays for the n rows into outdir, returning how many rows there actually were."""
+        from numpy.lib.format import open_memmap
+        columns = { 't1': np.int64, 'duration': np.int64, 'host': np.int32, 'path': np.int32 }
+        arrays = { name: open_memmap(os.path.join(outdir, '%s.npy' % name), mode='w+', dtype=dtype, shape=(n,))
+                   for name, dtype in columns.items() }
+        codes = { 'host': {}, 'path': {} }  # name -> code, in order of first appearance
+        chunk = { name: [] for name in columns }
+        i = 0
+        for path, host, t1, duration in rows:
+            seconds = duration_seconds(duration)
+            chunk['t1'].append(t1)
+            chunk['duration'].append(seconds if seconds is not None else -1)
+            chunk['host'].append(codes['host'].setdefault(host, len(codes['host'])))
+            chunk['path'].append(codes['path'].setdefault(path, len(codes['path'])))
+            if len(chunk['t1']) == self.chunksize:
+                i = self._flush_chunk(arrays, chunk, i, n)
+        i = self._flush_chunk(arrays, chunk, i, n)
+        for array in arrays.values():
+            array.flush()
+        del arrays
+        if i < n:
+            for name in columns:
+                self._truncate_array(np, os.path.join(outdir, '%s.npy' % name), i)
+        for name in codes:
+            np.save(os.path.join(outdir, '%ss.npy' % name), np.array(list(codes[name]), dtype=str))
+        return i
+
+    @staticmethod
+    def _truncate_array(np, npy_path, n):
+        """Replace the array in npy_path with its first n rows."""
+        npy_path_new = '%s.new' % npy_path
+        with open(npy_path_new, 'wb') as f:
+            np.save(f, np.load(npy_path, mmap_mode='r')[:n])
+        os.rename(npy_path_new, npy_path)
+
+    @staticmethod
+    def _flush_chunk(arrays, chunk, i, n):
+        """Copy the chunk into the arrays at row i, returning the next row."""
+        m = min(len(chunk['t1']), n - i)
+        for name, values in chunk.items():
+            arrays[name][i:i + m] = values[:m]
+            values.clear()
+        return i + m
+
+    def _export(self, np, outdir):
+        if self._config.collation_store == 'sqlite':
+            store = collation_store(self._config, self._verbose)
+            n = store.consolidated_count()
+            rows = ( (path, host, t1, duration) for rowid, path, host, t1, duration in store.consolidated_rows() )
+            written = self._write_arrays(np, outdir, n, rows)
+            store.close()
+        else:
+            files = self._consolidated_files()
+            n = self._count_file_rows(files)
+            written = self._write_arrays(np, outdir, n, self._file_rows(files))
+        if written != n:
+            sys.stderr.write('warning: consolidated history changed during export, exported %d of %d rows\n' % (written, n))
+        if self._verbose:
+            sys.stdout.write('exported %d rows\n' % written)
+
+    def export(self):
+        try:
+            import numpy as np
+        except ImportError:
+            sys.stderr.write('export requires NumPy, which is not installed\n')
+            sys.exit(1)
+        output = self._args.output
+        if output.endswith('.npz'):
+            # an uncompressed archive of the .npy files, built alongside it
+            outdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output)))
+            try:
+                self._export(np, outdir)
+                output_new = '%s.new' % output
+                with zipfile.ZipFile(output_new, 'w', zipfile.ZIP_STORED, allowZip64=True) as z:
+                    for filename in sorted(os.listdir(outdir)):
+                        z.write(os.path.join(outdir, filename), filename)
+                os.rename(output_new, output)
+            finally:
+                shutil.rmtree(outdir)
+        else:
+            os.makedirs(output, exist_ok=True)
+            self._export(np, output)
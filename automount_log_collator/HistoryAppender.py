@@ -0,0 +1,60 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import os
+import os.path
+
+class HistoryAppender(object):
+    """A HistoryAppender appends records to history files, keeping the most
+    recently used ones open, up to a limit.
+
+    When a history file is closed, either on eviction or flush, its modification
+    time is set to the timestamp of the last record appended, so the result on
+    disk is as if each record had been appended and timestamped individually."""
+
+    def __init__(self, maxopen=64):
+        self._maxopen = maxopen
+        self._files = collections.OrderedDict() # path -> [file, timestamp of last record]
+        self._dirs = set()                      # directories known to exist
+
+    def append(self, path, line, t):
+        """Append line to the history file at path, with integer timestamp t."""
+        entry = self._files.get(path)
+        if entry is None:
+            dirpath = os.path.dirname(path)
+            if dirpath not in self._dirs:
+                os.makedirs(dirpath, exist_ok=True)
+                self._dirs.add(dirpath)
+            if len(self._files) >= self._maxopen:
+                self._close(*self._files.popitem(last=False))
+            entry = [open(path, 'a'), t]
+            self._files[path] = entry
+        else:
+            self._files.move_to_end(path)
+            entry[1] = t
+        entry[0].write(line)
+
+    def _close(self, path, entry):
+        f, t = entry
+        f.close()
+        os.utime(path, (t, t))
+
+    def flush(self):
+        """Close all the history files, setting their timestamps."""
+        while self._files:
+            self._close(*self._files.popitem(last=False))
+        # directories may be purged once we're done
+        self._dirs.clear()
@@ -0,0 +1,73 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+
+from .util import rmdir_if_empty
+
+class Inventory(object):
+    """An Inventory of the collation trees for several hosts, built in a single
+    os.scandir pass over each tree.
+
+    For each mount path, paths records which hosts have collated it, and which of
+    the history and active files each has.  The directories seen are also kept,
+    so empty ones can be pruned without walking the trees again."""
+
+    filenames = ('history', 'active')
+
+    def __init__(self, host_dirs):
+        """host_dirs is a list of (host, collation directory for host)."""
+        self.paths = {}         # path -> {host: set of filenames}
+        self._dirs = {}         # host -> directories, children before parents
+        for host, host_dir in host_dirs:
+            self._dirs[host] = []
+            self._scan(host, host_dir, [])
+
+    def _scan(self, host, dirpath, components):
+        """Scan dirpath, where components are the unescaped path components below the host directory."""
+        subdirs = []
+        files = set()
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry)
+                    elif entry.name in self.filenames:
+                        files.add(entry.name)
+        except (NotADirectoryError, FileNotFoundError):
+            return
+        if files:
+            path = os.sep + os.path.join(*components) if components else os.sep
+            if path not in self.paths:
+                self.paths[path] = {}
+            self.paths[path][host] = files
+        for entry in subdirs:
+            name = entry.name[1:] if entry.name.startswith('_') else entry.name
+            self._scan(host, entry.path, components + [name])
+        self._dirs[host].append(dirpath)
+
+    def hosts(self, path, filename=None):
+        """Return the hosts which have collated path, optionally only those with the given file."""
+        return [ host for host, files in self.paths[path].items() if filename is None or filename in files ]
+
+    def prune_empty_dirs(self):
+        """Remove any of the directories seen which are now empty, returning how many were removed."""
+        n = 0
+        for dirpaths in self._dirs.values():
+            for dirpath in dirpaths:
+                if rmdir_if_empty(dirpath):
+                    n += 1
+        return n
@@ -17,9 +17,10 @@ import os
 
 class KeyedReader(object):
 
-    def __init__(self, path, keyfn):
+    def __init__(self, path, keyfn, lines=None):
+        """Read lines from the file at path, or if lines is given, from that instead."""
         self._path = path
-        self._f = open(path, 'r')
+        self._f = open(path, 'r') if lines is None else iter(lines)
         self._keyfn = keyfn
         self.next()
 
@@ -28,10 +29,11 @@ class KeyedReader(object):
 
     def next(self):
         if self._f is not None:
-            self.line = self._f.readline()
+            self.line = next(self._f, '')
             if self.line != '':
                 self.key = self._keyfn(self.line)
             else:
                 self.key = None
-                self._f.close()
+                if hasattr(self._f, 'close'):
+                    self._f.close()
                 self._f = None
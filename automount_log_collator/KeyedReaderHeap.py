@@ -0,0 +1,56 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+
+class KeyedReaderHeap(object):
+    """A KeyedReaderHeap merges lines from KeyedReader's in order of key, using a heap.
+
+    Lines with equal keys are merged in the order their readers were inserted."""
+
+    def __init__(self):
+        self._heap = []         # [key, insertion sequence, reader]
+        self.n = 0
+        self.lastkey = None
+        self.lastreader = None
+
+    def __str__(self):
+        return 'KRH(%d, %s)' % (self.n, ', '.join(str(entry[2]) for entry in sorted(self._heap)))
+
+    @property
+    def key(self):
+        """The key of the next line, or None if there are no more lines."""
+        return self._heap[0][0] if self._heap else None
+
+    def insert(self, reader):
+        if reader.key is not None:
+            heapq.heappush(self._heap, [reader.key, self.n, reader])
+        self.n += 1
+
+    def lines(self):
+        heap = self._heap
+        while heap:
+            entry = heap[0]
+            reader = entry[2]
+            self.lastkey = entry[0]
+            self.lastreader = reader
+            yield reader.line
+            reader.next()
+            if reader.key is None:
+                heapq.heappop(heap)
+            else:
+                # the sequence number is unchanged, so ties stay stable
+                entry[0] = reader.key
+                heapq.heapreplace(heap, entry)
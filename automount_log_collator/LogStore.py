@@ -0,0 +1,211 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import fcntl
+import itertools
+import os
+import os.path
+import sys
+import time
+
+from .util import timestamp_str, read_manifest, force_makedirs
+
+class LogStore(object):
+    """A log-structured collation store, which needs just a few files per host,
+    however many mount paths there are.
+
+    Each collation run writes its unmount records to a new segment file in
+    <collation-dir>/<host>, which is immutable once complete.  The host's index
+    lists its segments in order, with the number of records and the time range
+    of each, and is only updated holding the host's lock file, since collation
+    and consolidation may run at once.  Active mounts are kept only in the host's manifest, whose
+    modification time shows they are still in use.
+
+    A record is a line of timestamp, host, duration and path, so that the
+    history line for the path is just the record without the path."""
+
+    index_filename = 'index'
+    lock_filename = 'lock'
+
+    def __init__(self, config, verbose):
+        self._config = config
+        self._verbose = verbose
+        self._segment = None    # open file for the segment being written, if any
+        self._segment_host = None
+        self._segment_path = None
+        self._segment_n = 0
+        self._segment_first = None
+        self._segment_last = None
+        self._consumed = {}     # host -> segments read for consolidation
+
+    def _index_path(self, host=None):
+        return os.path.join(self._config.host_collation_dir(host), self.index_filename)
+
+    def read_index(self, host=None):
+        """Return a list of (segment, number of records, first timestamp, last timestamp)
+        for the complete segments of host, in order."""
+        try:
+            with open(self._index_path(host)) as f:
+                return [ (fields[0], int(fields[1]), fields[2], fields[3]) for fields in (line.split() for line in f) ]
+        except FileNotFoundError:
+            return []
+
+    @contextlib.contextmanager
+    def _locked(self, host):
+        """Hold the lock for updating the index of host."""
+        with open(os.path.join(self._config.host_collation_dir(host), self.lock_filename), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _write_index(self, host, entries):
+        index_path = self._index_path(host)
+        index_path_new = '%s.new' % index_path
+        with open(index_path_new, 'w') as f:
+            for entry in entries:
+                f.write('%s %d %s %s\n' % entry)
+        os.rename(index_path_new, index_path)
+
+    def _open_segment(self, host):
+        host_dir = self._config.host_collation_dir(host)
+        force_makedirs(host_dir, exist_ok=True, verbose=self._verbose)
+        # named by creation time, so the names sort in order too, with a sequence number for uniqueness
+        prefix = os.path.join(host_dir, 'segment-%s-%d' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+        for i in itertools.count():
+            self._segment_path = '%s-%d' % (prefix, i)
+            if not os.path.exists(self._segment_path):
+                try:
+                    fd = os.open('%s.new' % self._segment_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+                    break
+                except FileExistsError:
+                    pass
+        self._segment = os.fdopen(fd, 'w')
+        self._segment_host = host
+        self._segment_n = 0
+        self._segment_first = None
+        self._segment_last = None
+
+    def _write_record(self, timestamp_s, host, duration, path):
+        self._segment.write('%s %s %s %s\n' % (timestamp_s, host, duration, path))
+        self._segment_n += 1
+        if self._segment_first is None or timestamp_s < self._segment_first:
+            self._segment_first = timestamp_s
+        if self._segment_last is None or timestamp_s > self._segment_last:
+            self._segment_last = timestamp_s
+
+    def _close_segment(self):
+        """Complete the segment, and add it to the index."""
+        self._segment.close()
+        self._segment = None
+        if self._segment_n == 0:
+            os.remove('%s.new' % self._segment_path)
+            return
+        os.rename('%s.new' % self._segment_path, self._segment_path)
+        with self._locked(self._segment_host):
+            entries = self.read_index(self._segment_host)
+            entries.append((os.path.basename(self._segment_path), self._segment_n, self._segment_first, self._segment_last))
+            self._write_index(self._segment_host, entries)
+        if self._verbose:
+            sys.stdout.write('wrote %d records to %s\n' % (self._segment_n, self._segment_path))
+
+    def load_active(self, host=None):
+        """Active mounts are only kept in the manifest, so there's nothing else to load."""
+        return {}
+
+    def save_active(self, mounts, now, host=None):
+        return 0
+
+    def remove_active(self, path, host=None):
+        pass
+
+    def append(self, path, t1, host, duration):
+        """Append an unmount record to this run's segment for host."""
+        if self._segment is None:
+            self._open_segment(host)
+        self._write_record(timestamp_str(t1), host, duration, path)
+
+    def flush(self):
+        if self._segment is not None:
+            self._segment.flush()
+
+    def close(self):
+        """Close any segment being written, returning the number of directories removed, which is none."""
+        if self._segment is not None:
+            self._close_segment()
+        return 0
+
+    def import_history(self, host, histories):
+        """Write a segment for host from histories, pairs of path and history lines,
+        as when converting from a TreeStore."""
+        self._open_segment(host)
+        for path, lines in histories:
+            for line in lines:
+                if line.strip() == '':
+                    continue
+                timestamp_s, record_host, duration = line.split()
+                self._write_record(timestamp_s, record_host, duration, path)
+        self._close_segment()
+
+    def consolidation_sources(self, hosts):
+        """Return a dict of path to {host: history lines}, from the segments of hosts.
+        Paths which are active on a host have an entry for it, even with no lines."""
+        sources = {}
+        self._consumed = {}
+        for host in hosts:
+            host_dir = self._config.host_collation_dir(host)
+            segments = [ entry[0] for entry in self.read_index(host) ]
+            for segment in segments:
+                with open(os.path.join(host_dir, segment)) as f:
+                    for record in f:
+                        timestamp_s, record_host, duration, path = record.rstrip('\n').split(' ', 3)
+                        line = '%s %s %s\n' % (timestamp_s, record_host, duration)
+                        if path not in sources:
+                            sources[path] = {}
+                        if host not in sources[path]:
+                            sources[path][host] = []
+                        sources[path][host].append(line)
+            self._consumed[host] = segments
+            try:
+                for path in read_manifest(self._config.active_manifest_file(host)):
+                    if path not in sources:
+                        sources[path] = {}
+                    if host not in sources[path]:
+                        sources[path][host] = []
+            except (IOError, ValueError):
+                pass
+        return sources
+
+    def active_timestamp(self, host, path):
+        """There are no active files, only the manifest."""
+        return None
+
+    def finalize_consolidation(self):
+        """Ensure the consolidated segments don't get consolidated again, by removing them."""
+        for host, segments in self._consumed.items():
+            if not segments:
+                continue
+            host_dir = self._config.host_collation_dir(host)
+            # collation may have added a segment since we read the index, and the
+            # index must never list a segment which has been removed
+            consumed = set(segments)
+            with self._locked(host):
+                self._write_index(host, [ entry for entry in self.read_index(host) if entry[0] not in consumed ])
+            for segment in segments:
+                os.remove(os.path.join(host_dir, segment))
+        self._consumed = {}
+        return 0
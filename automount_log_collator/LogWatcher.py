@@ -0,0 +1,89 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+
+class LogWatcher(object):
+    """Waits for changes in the log directory, using inotify where that is
+    available, otherwise polling, or for a signal, so that a follower of the live
+    logfile can respond promptly to either.
+
+    The whole directory is watched, so that rotation of the live logfile is
+    noticed as well as writes to it.  Signals are noticed by way of the signal
+    wakeup file descriptor."""
+
+    IN_MODIFY = 0x00000002
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+
+    def __init__(self, logdir, poll_interval):
+        self._poll_interval = poll_interval
+        self._inotify_fd = self._inotify(logdir)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._previous_wakeup_fd = signal.set_wakeup_fd(self._wakeup_w)
+
+    @property
+    def inotify(self):
+        """Whether changes are noticed by inotify rather than polling."""
+        return self._inotify_fd is not None
+
+    def _inotify(self, logdir):
+        """Return an inotify file descriptor watching logdir, or None if inotify isn't available."""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        mask = self.IN_MODIFY | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        if libc.inotify_add_watch(fd, os.fsencode(logdir), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    @staticmethod
+    def _drain(fd):
+        try:
+            while os.read(fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout):
+        """Wait for up to timeout seconds, or until the log directory changes or a
+        signal arrives, though without inotify only until the next poll."""
+        fds = [ self._wakeup_r ]
+        if self._inotify_fd is not None:
+            fds.append(self._inotify_fd)
+        else:
+            timeout = min(timeout, self._poll_interval)
+        readable, writable, exceptional = select.select(fds, [], [], max(timeout, 0))
+        for fd in readable:
+            self._drain(fd)
+
+    def close(self):
+        signal.set_wakeup_fd(self._previous_wakeup_fd)
+        for fd in [ self._inotify_fd, self._wakeup_r, self._wakeup_w ]:
+            if fd is not None:
+                os.close(fd)
@@ -13,78 +13,185 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
 import os
 import os.path
-import pendulum
 import sys
 
-from .Collator import Collator
+from .Collator import Collator, collation_store
 from .Config import Config
+from .ConsolidationIndex import ConsolidationIndex, IndexEntryBuilder
 from .KeyedReader import KeyedReader
-from .KeyedReaderTree import KeyedReaderTree
+from .KeyedReaderHeap import KeyedReaderHeap
+from .Metrics import Metrics
+from .UsageStats import UsageStats
 from .util import ( bare_hostname, append_and_set_timestamp, timestamp_from_str, relativize_path,
-                    force_makedirs )
+                    force_makedirs, read_last_line )
 
 class Merger(object):
 
     def __init__(self, args):
         self._config = Config(args)
-        self._collator = Collator(self._config, args.verbose)
+        self._metrics = Metrics('consolidate')
+        self._collator = Collator(self._config, args.verbose, self._metrics)
         self._verbose = args.verbose
+        self._jobs = args.jobs
+        self._metrics_path = args.metrics
+        self._store = collation_store(self._config, args.verbose)
+        self._manifests = {}
+
+    def _active_timestamp(self, host, path):
+        """Return when path was last known to be mounted on host, or None if it isn't active."""
+        if host not in self._manifests:
+            self._manifests[host] = self._collator.host_active_manifest(host)
+        manifest = self._manifests[host]
+        if manifest is not None:
+            paths, t = manifest
+            return t if path in paths else None
+        # no manifest, so fall back to what the store has
+        return self._store.active_timestamp(host, path)
 
     @staticmethod
     def timestamp(line):
         """Return just the timestamp from a line in a collated file."""
-        return timestamp_from_str(line.split(maxsplit=1)[0])
+        return timestamp_from_str(Merger.key(line))
+
+    @staticmethod
+    def key(line):
+        """Return the merge key for a line in a collated file, which is the timestamp
+        field unparsed, since the YYYYMMDD-HH:MM:SS format sorts in time order."""
+        return line.split(maxsplit=1)[0]
 
     def _consolidation_path(self, path):
         """Return the path to the consolidated file."""
         return os.path.join(self._config.consolidation_dir(), relativize_path(path))
 
+    def _merge_task(self, path, host_sources, index, with_usage):
+        """Return the arguments for merge_consolidated for path, which are picklable for a worker process."""
+        active_t = None
+        for host in host_sources:
+            t = self._active_timestamp(host, path)
+            if t is not None and (active_t is None or t > active_t):
+                active_t = t
+        sources = [ source for source in host_sources.values() if source is not None ]
+        outpath = self._consolidation_path(path)
+        return (outpath, sources, active_t, self._verbose, index.valid_entry(path, outpath),
+                UsageStats(path) if with_usage else None)
+
     def merge(self):
-        all_paths = {}
-        for host in self._collator.hosts():
-            if self._verbose:
-                sys.stdout.write('merge checking host %s\n' % host)
-            for path in self._collator.paths(host):
-                if path not in all_paths:
-                    all_paths[path] = []
-                if self._verbose:
+        with self._metrics.phase('merge'):
+            self._merge()
+        if self._metrics_path is not None:
+            self._metrics.save(self._metrics_path)
+
+    def _merge(self):
+        if self._config.collation_store == 'sqlite':
+            # the consolidated history is in the database too
+            self._store.consolidate()
+            self._store.close()
+            return
+        all_sources = self._store.consolidation_sources(self._collator.hosts())
+        if self._verbose:
+            for path, host_sources in all_sources.items():
+                for host in host_sources:
                     sys.stdout.write('merge path %s for host %s\n' % (path, host))
-                all_paths[path].append(host)
-        for path, hosts in all_paths.items():
-            krt = KeyedReaderTree()
-            outpath = os.path.join(self._config.consolidation_dir(), relativize_path(path))
-            for history_path in [ self._collator.host_history_path(host, path) for host in hosts ]:
-                if os.path.isfile(history_path):
-                    if self._verbose:
-                        sys.stdout.write('history_path %s\n' % history_path)
-                    krt.insert(KeyedReader(history_path, self.__class__.timestamp))
-            if os.path.isfile(outpath):
-                krt.insert(KeyedReader(outpath, self.__class__.timestamp))
-            if krt.n > 0:
-                force_makedirs(os.path.dirname(outpath), exist_ok=True, verbose=self._verbose)
-                outpathnew = '%s.new' % outpath
-                with open(outpathnew, 'w') as f:
-                    for line in krt.lines():
-                        f.write(line)
-                os.rename(outpathnew, outpath)
-            # set the timestamp according to the last key, or the active path if that exists
-            t0 = krt.lastkey.int_timestamp if krt.lastkey is not None else None
-            for host in hosts:
-                active_path = self._collator.host_active_path(host, path)
-                if os.path.exists(active_path):
-                    t = os.stat(active_path).st_mtime
-                    if t0 is None or t > t0:
-                        t0 = t
-            os.utime(outpath, (t0, t0))
-        self._finalize_consolidated()
+        index = ConsolidationIndex(self._config.consolidation_dir())
+        indexed = index.load()
+        if not indexed:
+            # build the index for the files already consolidated, since a saved
+            # index is taken to cover all of them
+            index.scan(Merger.key)
+        # usage stats are folded in only if there are some already, otherwise the
+        # stats command rebuilds them from all the consolidated files
+        usage = UsageStats()
+        with_usage = usage.load(self._config.stats_cache_file)
+        paths = list(all_sources)
+        tasks = [ self._merge_task(path, all_sources[path], index, with_usage) for path in paths ]
+        if self._jobs > 1 and len(tasks) > 1:
+            # paths are independent, so merge them in worker processes, and only remove
+            # the history once all have succeeded, which result() ensures by raising
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self._jobs) as executor:
+                futures = [ executor.submit(merge_consolidated, *task) for task in tasks ]
+                results = [ future.result() for future in futures ]
+        else:
+            results = [ merge_consolidated(*task) for task in tasks ]
+        for path, (entry, path_usage, rewritten) in zip(paths, results):
+            if rewritten:
+                self._metrics.count('files_rewritten')
+            if entry is not None:
+                index.entries[path] = entry
+            if path_usage is not None:
+                usage.update(path_usage)
+        if paths or not indexed:
+            index.save()
+        if paths and with_usage:
+            usage.save(self._config.stats_cache_file)
+        # ensure the history doesn't get consolidated again
+        with self._metrics.phase('finalize'):
+            self._metrics.count('directories_purged', self._store.finalize_consolidation())
+
+def consolidated_lastkey(outpath):
+    """Return the last key in the consolidated file, reading only its tail, or None if it is empty."""
+    line = read_last_line(outpath)
+    return Merger.key(line) if line.strip() != '' else None
 
-    def _finalize_consolidated(self):
-        """Ensure the history files don't get consolidated again, by removing them."""
-        for host in self._collator.hosts():
-            for path in self._collator.paths(host):
-                history_path = self._collator.host_history_path(host, path)
-                if os.path.exists(history_path):
-                    os.remove(history_path)
-            self._collator.purge_empty_dirs(host)
+def merge_consolidated(outpath, sources, active_t, verbose, entry=None, usage=None):
+    """Merge the history sources, which are history files or lists of history lines,
+    into the consolidated file at outpath, and set its time to that of the last
+    line, or active_t if later.  This is the work for a single path, which may be
+    done in a worker process.
+
+    Return the updated index entry for the consolidated file, given its previous
+    entry, if that is still valid, usage, with the newly merged lines folded
+    into it, if given, and whether the file was rewritten rather than appended to."""
+    krh = KeyedReaderHeap()
+    for source in sources:
+        if isinstance(source, str):
+            if verbose:
+                sys.stdout.write('history_path %s\n' % source)
+            krh.insert(KeyedReader(source, Merger.key))
+        else:
+            krh.insert(KeyedReader(outpath, Merger.key, lines=source))
+    lastkey = None
+    appended = False
+    rewritten = False
+    builder = None
+    outreader = None
+    if os.path.isfile(outpath):
+        outkey = consolidated_lastkey(outpath)
+        if krh.key is None or outkey is None or krh.key > outkey:
+            # the new lines all follow the consolidated ones, which is usual, so just append them
+            builder = IndexEntryBuilder(Merger.key, entry) if entry is not None else IndexEntryBuilder.scan(Merger.key, outpath)
+            if krh.key is not None:
+                if verbose:
+                    sys.stdout.write('appending to %s\n' % outpath)
+                with open(outpath, 'a') as f:
+                    for line in krh.lines():
+                        f.write(line)
+                        builder.add(line)
+                        if usage is not None:
+                            usage.add(line)
+            lastkey = krh.lastkey if krh.lastkey is not None else outkey
+            appended = True
+        else:
+            outreader = KeyedReader(outpath, Merger.key)
+            krh.insert(outreader)
+            rewritten = True
+    if not appended and krh.n > 0:
+        force_makedirs(os.path.dirname(outpath), exist_ok=True, verbose=verbose)
+        builder = IndexEntryBuilder(Merger.key)
+        outpathnew = '%s.new' % outpath
+        with open(outpathnew, 'w') as f:
+            for line in krh.lines():
+                f.write(line)
+                builder.add(line)
+                if usage is not None and krh.lastreader is not outreader:
+                    usage.add(line)
+        os.rename(outpathnew, outpath)
+        lastkey = krh.lastkey
+    # set the timestamp according to the last key, or the active path if that exists
+    t0 = timestamp_from_str(lastkey) if lastkey is not None else None
+    if active_t is not None and (t0 is None or active_t > t0):
+        t0 = active_t
+    os.utime(outpath, (t0, t0))
+    return (builder.entry() if builder is not None else None), usage, rewritten
@@ -0,0 +1,84 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import json
+import os
+import os.path
+import time
+
+class Metrics(object):
+    """Timings of the phases of a run, and its counters, which are kept
+    regardless of verbosity, and saved at the end of the run as JSON, or in
+    Prometheus textfile format if the filename ends with .prom."""
+
+    counter_names = [ 'lines_read', 'events_matched', 'history_appends', 'files_rewritten', 'directories_purged' ]
+
+    prefix = 'automount_log_collator'
+
+    def __init__(self, command):
+        self.command = command
+        self.phases = {}        # (phase, logfile or None) -> total seconds, in order of first occurrence
+        self.counters = dict.fromkeys(self.counter_names, 0)
+
+    @contextlib.contextmanager
+    def phase(self, name, logfile=None):
+        """Time the phase, which is for the logfile if given, adding to any previous time
+        in the same phase, as when following a logfile."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            key = (name, logfile)
+            self.phases[key] = self.phases.get(key, 0) + time.perf_counter() - start
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def _json(self):
+        phases = []
+        for (name, logfile), seconds in self.phases.items():
+            phase = { 'phase': name, 'seconds': seconds }
+            if logfile is not None:
+                phase['logfile'] = logfile
+            phases.append(phase)
+        return '%s\n' % json.dumps({ 'command': self.command, 'timestamp': int(time.time()),
+                                     'phases': phases, 'counters': self.counters }, indent=2, sort_keys=True)
+
+    @staticmethod
+    def _labels(**labels):
+        return ','.join('%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"'))
+                        for name, value in sorted(labels.items()) if value is not None)
+
+    def _prometheus(self):
+        lines = [ '# HELP %s_phase_seconds Time taken by each phase of the last run.' % self.prefix,
+                  '# TYPE %s_phase_seconds gauge' % self.prefix ]
+        for (name, logfile), seconds in self.phases.items():
+            lines.append('%s_phase_seconds{%s} %f' % (self.prefix, self._labels(command=self.command, phase=name, logfile=logfile), seconds))
+        for name in self.counter_names:
+            lines.extend([ '# HELP %s_%s Number of %s in the last run.' % (self.prefix, name, name.replace('_', ' ')),
+                           '# TYPE %s_%s gauge' % (self.prefix, name),
+                           '%s_%s{%s} %d' % (self.prefix, name, self._labels(command=self.command), self.counters[name]) ])
+        lines.extend([ '# HELP %s_last_run_timestamp_seconds When the last run finished.' % self.prefix,
+                       '# TYPE %s_last_run_timestamp_seconds gauge' % self.prefix,
+                       '%s_last_run_timestamp_seconds{%s} %d' % (self.prefix, self._labels(command=self.command), int(time.time())) ])
+        return ''.join('%s\n' % line for line in lines)
+
+    def save(self, path):
+        """Atomically replace the metrics file, so a collector never sees it partly written."""
+        path_new = '%s.new' % path
+        with open(path_new, 'w') as f:
+            f.write(self._prometheus() if path.endswith('.prom') else self._json())
+        os.rename(path_new, path)
@@ -0,0 +1,127 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import locale
+import os
+import os.path
+import sys
+
+from .Collator import collation_store
+from .Config import Config
+from .ConsolidationIndex import ConsolidationIndex
+from .Merger import Merger
+from .util import timestamp_from_str
+
+def key_from_arg(s):
+    """Return the merge key for a time given as YYYYMMDD, or YYYYMMDD-HH:MM[:SS]."""
+    if len(s) == 8:
+        s = '%s-00:00:00' % s
+    elif len(s) == 14:
+        s = '%s:00' % s
+    # validates the format
+    timestamp_from_str(s)
+    return s
+
+class Query(object):
+    """Queries consolidated history by path prefix, host and time range, using the
+    consolidation index to skip files outside the range, and to seek within
+    those inside it."""
+
+    def __init__(self, args):
+        self._config = Config(args)
+        self._verbose = args.verbose
+        parser = argparse.ArgumentParser(prog='%s query' % os.path.basename(sys.argv[0]),
+                                         description='query consolidated mount history')
+        parser.add_argument('--host', action='append', dest='hosts', metavar='HOST', help='only mounts on this host, may be repeated')
+        parser.add_argument('--since', metavar='TIME', type=key_from_arg, help='only unmounts from YYYYMMDD[-HH:MM[:SS]]')
+        parser.add_argument('--until', metavar='TIME', type=key_from_arg, help='only unmounts before YYYYMMDD[-HH:MM[:SS]]')
+        parser.add_argument('prefixes', metavar='PATH', nargs='*', help='only paths with this prefix')
+        self._args = parser.parse_args(args.args)
+        self._encoding = locale.getpreferredencoding(False)
+
+    def _path_matches(self, path):
+        if not self._args.prefixes:
+            return True
+        for prefix in self._args.prefixes:
+            prefix = prefix.rstrip('/')
+            if path == prefix or path.startswith(prefix + '/') or prefix == '':
+                return True
+        return False
+
+    def _line_matches(self, line):
+        fields = line.split()
+        if len(fields) < 2:
+            return False
+        return self._args.hosts is None or fields[1] in self._args.hosts
+
+    def _file_lines(self, outpath, entry):
+        """Generate the lines of the consolidated file in the time range."""
+        since = self._args.since
+        until = self._args.until
+        with open(outpath, 'rb') as f:
+            if entry is not None and since is not None:
+                f.seek(ConsolidationIndex.seek_offset(entry, since))
+            for rawline in f:
+                line = rawline.decode(self._encoding)
+                if line.strip() == '':
+                    continue
+                key = Merger.key(line)
+                if since is not None and key < since:
+                    continue
+                if until is not None and key >= until:
+                    break
+                yield line
+
+    def _file_query(self):
+        index = ConsolidationIndex(self._config.consolidation_dir())
+        for path in index.consolidated_paths():
+            if not self._path_matches(path):
+                continue
+            outpath = os.path.join(self._config.consolidation_dir(), path.lstrip(os.sep))
+            entry = index.valid_entry(path, outpath)
+            if entry is not None and (entry['first'] is None or
+                                      self._args.since is not None and entry['last'] < self._args.since or
+                                      self._args.until is not None and entry['first'] >= self._args.until):
+                if self._verbose:
+                    sys.stderr.write('skipping %s\n' % outpath)
+                continue
+            try:
+                for line in self._file_lines(outpath, entry):
+                    if self._line_matches(line):
+                        yield path, line
+            except FileNotFoundError:
+                pass
+
+    def run(self):
+        if self._config.collation_store == 'sqlite':
+            store = collation_store(self._config, self._verbose)
+            results = store.query(self._args.prefixes, self._args.hosts,
+                                  timestamp_from_str(self._args.since) if self._args.since is not None else None,
+                                  timestamp_from_str(self._args.until) if self._args.until is not None else None)
+        else:
+            results = self._file_query()
+        for path, line in results:
+            sys.stdout.write('%s %s' % (path, line))
+
+    def list_files(self):
+        """List the consolidated paths with any of the prefixes."""
+        if self._config.collation_store == 'sqlite':
+            paths = collation_store(self._config, self._verbose).consolidated_paths()
+        else:
+            paths = ConsolidationIndex(self._config.consolidation_dir()).consolidated_paths()
+        for path in paths:
+            if self._path_matches(path):
+                sys.stdout.write('%s\n' % path)
@@ -13,68 +13,299 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import argparse
+import collections
+import concurrent.futures
 import gzip
+import locale
 import os
 import os.path
-import pendulum
 import re
+import signal
 import sys
+import time
 
+from .CentralCollator import CentralCollator
 from .Collator import Collator
 from .Config import Config
-from .util import timestamp_str
+from .Event import Event
+from .LogWatcher import LogWatcher
+from .Metrics import Metrics
+from .TimestampParser import TimestampParser
+from .util import local_timestamp, timestamp_str
+
+loglineRE = re.compile(r"""^(\S+\s+\d+\s+\d+:\d+:\d+)\s+(\S+)\s+\S+\s+(\S+)\s+(/\S*)$""")
+
+class LogfileEvents(object):
+    """Iterable over the mount Events in an open binary logfile.
+
+    The logfile is read in large blocks, and only lines containing one of the
+    markers are decoded and matched against loglineRE, as most lines are not
+    mount events.
+
+    After iteration, offset is the position following the last line consumed.
+    If complete_lines_only, a trailing partial line is left unconsumed, as it
+    is presumably still being written.  If end is given, the logfile is read no
+    further than that offset."""
+
+    blocksize = 1048576
+    markers = (b'mounted', b'expired')
+
+    def __init__(self, logf, logpath, logfile_year, logfile_month, offset=0, complete_lines_only=False, end=None):
+        self._logf = logf
+        self._logpath = logpath
+        self._logfile_year = logfile_year
+        self._logfile_month = logfile_month
+        self._complete_lines_only = complete_lines_only
+        self._end = end
+        self.offset = offset
+        self.lineno = 0
+
+    def _candidate_lines(self, block, end):
+        """Generate the lines in block[:end] which contain a marker, setting lineno for each.
+
+        block[:end] must comprise whole lines."""
+        lineno0 = self.lineno
+        counted = 0             # newlines have been counted in block[:counted]
+        nexts = [ block.find(marker, 0, end) for marker in self.markers ]
+        nexts = [ end if pos < 0 else pos for pos in nexts ]
+        while True:
+            pos = min(nexts)
+            if pos >= end:
+                break
+            start = block.rfind(b'\n', 0, pos) + 1
+            stop = block.find(b'\n', pos, end)
+            if stop < 0:
+                stop = end
+            lineno0 += block.count(b'\n', counted, start)
+            counted = start
+            self.lineno = lineno0 + 1
+            yield block[start:stop]
+            # skip any further markers in the same line
+            for i, marker in enumerate(self.markers):
+                if nexts[i] < stop:
+                    nexts[i] = block.find(marker, stop, end)
+                    if nexts[i] < 0:
+                        nexts[i] = end
+        self.lineno = lineno0 + block.count(b'\n', counted, end)
+
+    def __iter__(self):
+        timestamp_parser = TimestampParser(self._logfile_year, self._logfile_month)
+        encoding = locale.getpreferredencoding(False)
+        try:
+            partial = b''
+            while True:
+                size = self.blocksize
+                if self._end is not None:
+                    size = min(size, self._end - self.offset - len(partial))
+                block = self._logf.read(size) if size > 0 else b''
+                if block == b'':
+                    if partial == b'' or self._complete_lines_only:
+                        break
+                    # final line has no newline
+                    block = partial
+                    end = len(partial)
+                    partial = b''
+                else:
+                    if partial != b'':
+                        block = partial + block
+                    end = block.rfind(b'\n') + 1
+                    partial = block[end:]
+                for rawline in self._candidate_lines(block, end):
+                    try:
+                        # as for a logfile opened in text mode, a CRLF line ending is not part of the line
+                        logline = rawline.rstrip(b'\r').decode(encoding)
+                        m = loglineRE.match(logline)
+                        if m:
+                            # the parser infers the year for the timestamp, which is usually the same as the logfile year,
+                            # except when we roll over from Dec to Jan
+                            yield Event(m.group(3), timestamp_parser.parse(m.group(1)), m.group(4), m.group(2))
+                    except UnicodeDecodeError:
+                        sys.stderr.write('warning: ignoring badly encoded line at %s:%d\n' % (self._logpath, self.lineno))
+                self.offset += end
+        except Exception:
+            sys.stderr.write('failed at %s:%d\n' % (self._logpath, self.lineno))
+            raise
+
+def compressed_logfile_events(logpath, logfile_year, logfile_month, last_collation):
+    """Return the list of mount events in a compressed logfile which are later than
+    last_collation, and the number of lines read, for parsing in a worker process."""
+    with gzip.open(logpath, 'rb') as logf:
+        logfile_events = LogfileEvents(logf, logpath, logfile_year, logfile_month)
+        events = [ event for event in logfile_events
+                   if last_collation is None or event.t > last_collation ]
+        return events, logfile_events.lineno
+
+def logfile_chunks(logf, start, stop, chunksize):
+    """Return the offsets dividing the byte range from start to stop of an open binary
+    logfile into chunks of about chunksize, each of which but the last ends with a newline."""
+    offsets = [start]
+    target = start + chunksize
+    while target < stop:
+        logf.seek(target - 1)
+        logf.readline()
+        offset = logf.tell()
+        if offset >= stop:
+            break
+        offsets.append(offset)
+        target = offset + chunksize
+    offsets.append(stop)
+    return offsets
+
+def logfile_chunk_events(logpath, inode, logfile_year, logfile_month, start, stop, last_collation):
+    """Return the list of mount events in the byte range from start to stop of an
+    uncompressed logfile which are later than last_collation, the number of lines
+    read, and the offset following the last complete line, for parsing in a worker
+    process.  The timestamp year is inferred from the logfile year and month just as
+    when the logfile is parsed in one go."""
+    with open(logpath, 'rb') as logf:
+        if os.fstat(logf.fileno()).st_ino != inode:
+            raise RuntimeError('%s was rotated while collating' % logpath)
+        logf.seek(start)
+        logfile_events = LogfileEvents(logf, '%s from byte %d' % (logpath, start), logfile_year, logfile_month,
+                                       start, complete_lines_only=True, end=stop)
+        events = [ event for event in logfile_events
+                   if last_collation is None or event.t > last_collation ]
+        return events, logfile_events.lineno, logfile_events.offset
 
 class Scanner(object):
 
+    # with more than one job, an uncompressed logfile with more than this to collate is parsed in chunks
+    chunksize = 64 * 1048576
+
     def __init__(self, args):
         self._args = args
         self._config = Config(args)
-        self._collator = Collator(self._config, self._args.verbose)
+        parser = argparse.ArgumentParser(prog='%s collate' % os.path.basename(sys.argv[0]),
+                                         description='collate automount logfiles')
+        parser.add_argument('--follow', action='store_true', help='keep collating the live logfile as it is written, until terminated')
+        parser.add_argument('--central', action='store_true',
+                            help='the logfiles are aggregated from many hosts, so collate each host by its syslog hostname')
+        parser.add_argument('--checkpoint-interval', metavar='SECONDS', type=float, default=60,
+                            help='when following, how often to save the collation, default 60')
+        parser.add_argument('--poll-interval', metavar='SECONDS', type=float, default=5,
+                            help='when following without inotify, how often to check the live logfile, default 5')
+        self._options = parser.parse_args(args.args)
+        self._metrics = Metrics('collate')
+        if self._options.central:
+            self._collator = CentralCollator(self._config, self._args.verbose, self._metrics, self._args.jobs)
+        else:
+            self._collator = Collator(self._config, self._args.verbose, self._metrics)
 
-    def _collate_if_pending(self, logpath, logfile_dt, compressed):
+    def _pending(self, logpath, logfile_t):
         # skip processing of files we've already seen
-        if not self._collator.pending(logfile_dt):
+        if not self._collator.pending(logfile_t):
             if self._args.verbose:
-                sys.stdout.write('skipping %s, timestamp %s\n' % (logpath, timestamp_str(logfile_dt)))
+                sys.stdout.write('skipping %s, timestamp %s\n' % (logpath, timestamp_str(logfile_t)))
+            return False
+        return True
+
+    def _collate(self, events):
+        if self._options.central:
+            self._metrics.count('events_matched', self._collator.collate(events))
             return
+        n = 0
+        for event in events:
+            if event.action == 'mounted':
+                self._collator.mount(event.t, event.path)
+            elif event.action == 'expired':
+                self._collator.unmount(event.t, event.path)
+            n += 1
+        self._metrics.count('events_matched', n)
 
+    def _collate_compressed(self, logpath, logfile_year, logfile_month):
         if self._args.verbose:
             sys.stdout.write('collating %s\n' % logpath)
+        with self._metrics.phase('scan', logpath), gzip.open(logpath, 'rb') as logf:
+            events = LogfileEvents(logf, logpath, logfile_year, logfile_month)
+            self._collate(events)
+            self._metrics.count('lines_read', events.lineno)
 
-        loglineRE = re.compile(r"""^(\S+\s+\d+\s+\d+:\d+:\d+)\s+\S+\s+\S+\s+(\S+)\s+(/\S*)$""")
-        if compressed:
-            logf = gzip.open(logpath, 'rt')
-        else:
-            logf = open(logpath, 'r')
-        loglineno = 0
-        try:
-            for logline in logf:
-                try:
-                    loglineno += 1
-                    m = loglineRE.match(logline)
-                    if m:
-                        # infer the year for the timestamp, which is usually the same as the logfile year,
-                        # except when we roll over from Dec to Jan
-                        timestamp_s = m.group(1)
-                        timestamp_year = logfile_dt.year - 1 if timestamp_s.startswith('Dec') and logfile_dt.month == 1 else logfile_dt.year
-                        timestamp = pendulum.parse('%d %s' % (timestamp_year, timestamp_s), tz=pendulum.now().timezone, strict=False)
-                        action = m.group(2)
-                        path = m.group(3)
-                        if self._collator.pending(logfile_dt):
-                            if action == 'mounted':
-                                self._collator.mount(timestamp, path)
-                            elif action == 'expired':
-                                self._collator.unmount(timestamp, path)
-                except UnicodeDecodeError:
-                    sys.stderr.write('warning: ignoring badly encoded line at %s:%d\n' % (logpath, loglineno))
-        except:
-            sys.stderr.write('failed at %s:%d\n' % (logpath, loglineno))
-            raise
-        finally:
-            logf.close()
+    def _collate_compressed_parallel(self, logfiles):
+        """Parse the compressed logfiles in worker processes, but collate their events in logfile order."""
+        jobs = self._args.jobs
+        last_collation = self._collator.last_collation()
+        remaining = collections.deque(logfiles)
+        submitted = collections.deque()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            while remaining or submitted:
+                # limit how many parsed logfiles may be waiting, as their events are held in memory
+                while remaining and len(submitted) < 2 * jobs:
+                    logpath, logfile_year, logfile_month = remaining.popleft()
+                    submitted.append((logpath, executor.submit(compressed_logfile_events, logpath, logfile_year, logfile_month,
+                                                               last_collation)))
+                logpath, future = submitted.popleft()
+                with self._metrics.phase('scan', logpath):
+                    events, lines_read = future.result()
+                    if self._args.verbose:
+                        sys.stdout.write('collating %s\n' % logpath)
+                    self._collate(events)
+                self._metrics.count('lines_read', lines_read)
 
-    def scan(self):
+    def _collate_live(self, logpath, logfile_year, logfile_month):
+        if self._args.verbose:
+            sys.stdout.write('collating %s\n' % logpath)
+        # read bytes, so we can track the offset in the live logfile
+        with self._metrics.phase('scan', logpath), open(logpath, 'rb') as logf:
+            st = os.fstat(logf.fileno())
+            offset = self._resume_offset(logpath, st)
+            if self._args.jobs > 1 and st.st_size - offset > self.chunksize:
+                offset, lines_read = self._collate_live_parallel(logf, logpath, logfile_year, logfile_month, offset, st)
+            else:
+                logf.seek(offset)
+                events = LogfileEvents(logf, logpath, logfile_year, logfile_month, offset, complete_lines_only=True)
+                self._collate(events)
+                offset, lines_read = events.offset, events.lineno
+            st = os.fstat(logf.fileno())
+            self._collator.set_logfile_checkpoint(st.st_ino, st.st_size, offset)
+            self._metrics.count('lines_read', lines_read)
+
+    def _collate_live_parallel(self, logf, logpath, logfile_year, logfile_month, offset, st):
+        """Parse the uncompressed logfile from offset in chunks in worker processes, but
+        collate their events in logfile order, returning the offset following the last
+        complete line, and the number of lines read."""
+        jobs = self._args.jobs
+        last_collation = self._collator.last_collation()
+        offsets = logfile_chunks(logf, offset, st.st_size, self.chunksize)
+        if self._args.verbose:
+            sys.stdout.write('parsing %s in %d chunks\n' % (logpath, len(offsets) - 1))
+        remaining = collections.deque(zip(offsets, offsets[1:]))
+        submitted = collections.deque()
+        lines_read = 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            while remaining or submitted:
+                # limit how many parsed chunks may be waiting, as their events are held in memory
+                while remaining and len(submitted) < 2 * jobs:
+                    start, stop = remaining.popleft()
+                    submitted.append(executor.submit(logfile_chunk_events, logpath, st.st_ino, logfile_year, logfile_month,
+                                                     start, stop, last_collation))
+                events, chunk_lines_read, offset = submitted.popleft().result()
+                self._collate(events)
+                lines_read += chunk_lines_read
+        return offset, lines_read
+
+    def _resume_offset(self, logpath, st):
+        """Return the offset from which to continue processing the live logfile,
+        which is zero if it has been rotated or truncated since the checkpoint."""
+        checkpoint = self._collator.logfile_checkpoint()
+        if checkpoint is None:
+            return 0
+        inode, size, offset = checkpoint
+        if st.st_ino != inode:
+            if self._args.verbose:
+                sys.stdout.write('%s has been rotated, scanning from start\n' % logpath)
+            return 0
+        if st.st_size < size or st.st_size < offset:
+            if self._args.verbose:
+                sys.stdout.write('%s has been truncated, scanning from start\n' % logpath)
+            return 0
+        if self._args.verbose:
+            sys.stdout.write('resuming %s at offset %d\n' % (logpath, offset))
+        return offset
+
+    def _scan_compressed(self):
         # important to process log-rotated logfiles in order, so timestamps are preserved
+        logfiles = []
         for entry in sorted(os.listdir(self._config.logdir)):
             automountLogRE = re.compile(r"""^automount-(\d\d\d\d)(\d\d)(\d\d).gz$""")
             m = automountLogRE.match(entry)
@@ -83,13 +314,136 @@ class Scanner(object):
                 logfile_year = int(m.group(1))
                 logfile_month = int(m.group(2))
                 logfile_day = int(m.group(3))
-                logfile_dt = pendulum.DateTime(logfile_year, logfile_month, logfile_day, tzinfo=pendulum.now().timezone)
-                self._collate_if_pending(logpath, logfile_dt, compressed=True)
+                logfile_t = local_timestamp(logfile_year, logfile_month, logfile_day)
+                if self._pending(logpath, logfile_t):
+                    logfiles.append((logpath, logfile_year, logfile_month))
+        if self._args.jobs > 1 and len(logfiles) > 1:
+            self._collate_compressed_parallel(logfiles)
+        else:
+            for logpath, logfile_year, logfile_month in logfiles:
+                self._collate_compressed(logpath, logfile_year, logfile_month)
+
+    def scan(self):
+        try:
+            if self._options.follow:
+                self._follow()
+            else:
+                self._scan()
+        finally:
+            if self._options.central:
+                self._collator.close()
+
+    def _scan(self):
+        self._scan_compressed()
 
         # finally look at the uncompressed logfile
         logpath = os.path.join(self._config.logdir, 'automount')
         if os.path.exists(logpath):
-            logfile_dt = pendulum.from_timestamp(os.path.getmtime(logpath), tz=pendulum.now().timezone_name)
-            self._collate_if_pending(logpath, logfile_dt, compressed=False)
+            logfile_t = os.path.getmtime(logpath)
+            if self._pending(logpath, logfile_t):
+                logfile_tm = time.localtime(logfile_t)
+                self._collate_live(logpath, logfile_tm.tm_year, logfile_tm.tm_mon)
+
+        self._checkpoint()
 
+    def _checkpoint(self):
         self._collator.finalize()
+        if self._args.metrics is not None:
+            self._metrics.save(self._args.metrics)
+
+    def _collate_appended(self, logf, logpath, live=True, complete_lines_only=True):
+        """Collate what has been appended to the open logfile since it was last read,
+        which is the live logfile, unless it has been rotated."""
+        offset = logf.tell()
+        if os.fstat(logf.fileno()).st_size < offset:
+            if self._args.verbose:
+                sys.stdout.write('%s has been truncated, following from start\n' % logpath)
+            offset = 0
+        logf.seek(offset)
+        # the logfile is current, so the year and month for its timestamps are now
+        now = time.localtime()
+        events = LogfileEvents(logf, logpath, now.tm_year, now.tm_mon, offset, complete_lines_only)
+        with self._metrics.phase('scan', logpath):
+            self._collate(events)
+        self._metrics.count('lines_read', events.lineno)
+        # leave any partial line to be read next time
+        logf.seek(events.offset)
+        if live:
+            st = os.fstat(logf.fileno())
+            self._collator.set_logfile_checkpoint(st.st_ino, st.st_size, events.offset)
+
+    def _follow_live(self, logpath, logf, rotated):
+        """Collate what has been appended to the live logfile, and to those in rotated,
+        following it to a new logfile if it has been rotated, and return the open live
+        logfile, or None if there isn't one yet."""
+        for rotated_logf in rotated:
+            self._collate_appended(rotated_logf, logpath, live=False)
+        try:
+            st = os.stat(logpath)
+        except FileNotFoundError:
+            st = None
+        if logf is not None:
+            self._collate_appended(logf, logpath, live=True)
+            if st is not None and st.st_ino == os.fstat(logf.fileno()).st_ino:
+                return logf
+            # the logger may write to the rotated logfile until it reopens the live one
+            if self._args.verbose:
+                sys.stdout.write('%s has been rotated, following new logfile\n' % logpath)
+            rotated.append(logf)
+        try:
+            logf = open(logpath, 'rb')
+        except FileNotFoundError:
+            return None
+        self._collate_appended(logf, logpath)
+        return logf
+
+    def _follow(self):
+        """Collate the pending logfiles as scan does, and then keep collating the live
+        logfile as it is written, following it when it is rotated, until terminated by
+        SIGTERM or SIGINT.  The collation is saved periodically, and on termination."""
+        stopping = []
+        def stop(signum, frame):
+            stopping.append(signum)
+        handlers = { signum: signal.signal(signum, stop) for signum in [ signal.SIGTERM, signal.SIGINT ] }
+        watcher = LogWatcher(self._config.logdir, self._options.poll_interval)
+        logpath = os.path.join(self._config.logdir, 'automount')
+        logf = None
+        rotated = []    # open rotated logfiles, until the next checkpoint
+        try:
+            if self._args.verbose:
+                sys.stdout.write('following %s using %s\n' % (logpath, 'inotify' if watcher.inotify else 'polling'))
+            self._scan_compressed()
+            try:
+                logf = open(logpath, 'rb')
+                logf.seek(self._resume_offset(logpath, os.fstat(logf.fileno())))
+            except FileNotFoundError:
+                pass
+            next_checkpoint = time.monotonic()
+            while True:
+                logf = self._follow_live(logpath, logf, rotated)
+                if stopping:
+                    break
+                if time.monotonic() >= next_checkpoint:
+                    self._close_rotated(logpath, rotated)
+                    self._checkpoint()
+                    next_checkpoint = time.monotonic() + self._options.checkpoint_interval
+                watcher.wait(next_checkpoint - time.monotonic())
+            if self._args.verbose:
+                sys.stdout.write('stopping on signal %d\n' % stopping[0])
+            self._close_rotated(logpath, rotated)
+        finally:
+            watcher.close()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            for rotated_logf in rotated:
+                rotated_logf.close()
+            if logf is not None:
+                logf.close()
+        self._checkpoint()
+
+    def _close_rotated(self, logpath, rotated):
+        """Finish the rotated logfiles, including any final line without a newline, and close them."""
+        for rotated_logf in rotated:
+            self._collate_appended(rotated_logf, logpath, live=False, complete_lines_only=False)
+            rotated_logf.close()
+        rotated.clear()
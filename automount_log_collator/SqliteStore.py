@@ -0,0 +1,169 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os.path
+import sqlite3
+import sys
+
+from .util import timestamp_str, timestamp_from_str, force_makedirs
+
+class SqliteStore(object):
+    """A collation store in an SQLite database, which holds the consolidated
+    history too, so consolidation is a single insert-select.
+
+    Unmount records are inserted in batches, each in a single transaction.  As
+    for the LogStore, active mounts are kept only in the manifest.  Rows are
+    ordered by their rowid within each path and time, which is the order in
+    which they were collated."""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS collated (
+            path TEXT NOT NULL,
+            host TEXT NOT NULL,
+            t1 INTEGER NOT NULL,
+            duration TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS consolidated (
+            path TEXT NOT NULL,
+            host TEXT NOT NULL,
+            t1 INTEGER NOT NULL,
+            duration TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS consolidated_path ON consolidated (path, t1);
+        CREATE INDEX IF NOT EXISTS consolidated_host ON consolidated (host, t1);
+        CREATE INDEX IF NOT EXISTS consolidated_t1 ON consolidated (t1);
+        """
+
+    def __init__(self, config, verbose, batchsize=10000):
+        self._config = config
+        self._verbose = verbose
+        self._batchsize = batchsize
+        self._db = None         # connected when first needed
+        self._pending = []      # rows for collated table
+
+    def _connect(self):
+        if self._db is None:
+            force_makedirs(os.path.dirname(self._config.collation_db), exist_ok=True, verbose=self._verbose)
+            # hosts may be collating into the same database at once, so wait for their transactions
+            self._db = sqlite3.connect(self._config.collation_db, timeout=60)
+            self._db.executescript(self.schema)
+        return self._db
+
+    def load_active(self, host=None):
+        """Active mounts are only kept in the manifest, so there's nothing else to load."""
+        return {}
+
+    def save_active(self, mounts, now, host=None):
+        return 0
+
+    def remove_active(self, path, host=None):
+        pass
+
+    def append(self, path, t1, host, duration):
+        """Add an unmount record, to be inserted with the current batch."""
+        self._pending.append((path, host, t1, duration))
+        if len(self._pending) >= self._batchsize:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            db = self._connect()
+            with db:
+                db.executemany('INSERT INTO collated (path, host, t1, duration) VALUES (?, ?, ?, ?)', self._pending)
+            self._pending = []
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        return 0
+
+    def _rows(self, path, lines):
+        for line in lines:
+            if line.strip() != '':
+                timestamp_s, host, duration = line.split()
+                yield (path, host, timestamp_from_str(timestamp_s), duration)
+
+    def import_history(self, host, histories):
+        """Insert the collated history for host from histories, pairs of path and
+        history lines, as when converting from a TreeStore."""
+        db = self._connect()
+        with db:
+            for path, lines in histories:
+                db.executemany('INSERT INTO collated (path, host, t1, duration) VALUES (?, ?, ?, ?)', self._rows(path, lines))
+
+    def import_consolidated(self, path, lines):
+        """Insert the consolidated history for path, as when converting from consolidated files."""
+        db = self._connect()
+        with db:
+            db.executemany('INSERT INTO consolidated (path, host, t1, duration) VALUES (?, ?, ?, ?)', self._rows(path, lines))
+
+    def has_consolidated(self):
+        """Return whether there is any consolidated history."""
+        return self._connect().execute('SELECT 1 FROM consolidated LIMIT 1').fetchone() is not None
+
+    def consolidate(self):
+        """Move all the collated rows into the consolidated table, returning how many there were."""
+        db = self._connect()
+        with db:
+            n = db.execute('INSERT INTO consolidated (path, host, t1, duration) '
+                           'SELECT path, host, t1, duration FROM collated ORDER BY rowid').rowcount
+            db.execute('DELETE FROM collated')
+        if self._verbose:
+            sys.stdout.write('consolidated %d records\n' % n)
+        return n
+
+    def consolidated_count(self):
+        """Return the number of consolidated rows."""
+        return self._connect().execute('SELECT COUNT(*) FROM consolidated').fetchone()[0]
+
+    def consolidated_rows(self, after_rowid=0):
+        """Generate rowid, path, host, t1 and duration for the consolidated rows after after_rowid,
+        which are those consolidated since, in order."""
+        sql = 'SELECT rowid, path, host, t1, duration FROM consolidated WHERE rowid > ? ORDER BY rowid'
+        for row in self._connect().execute(sql, (after_rowid,)):
+            yield row
+
+    def consolidated_paths(self):
+        """Return the paths with consolidated history, in order."""
+        return [ row[0] for row in self._connect().execute('SELECT DISTINCT path FROM consolidated ORDER BY path') ]
+
+    def query(self, prefixes, hosts, since, until):
+        """Generate path and history line for the consolidated rows for paths with
+        any of the prefixes, on any of the hosts, with times in [since, until),
+        where any of those may be None for no restriction."""
+        where = []
+        params = []
+        if prefixes:
+            conditions = []
+            for prefix in prefixes:
+                prefix = prefix.rstrip('/')
+                conditions.append('path = ? OR substr(path, 1, ?) = ?')
+                params.extend([prefix, len(prefix) + 1, prefix + '/'])
+            where.append('(%s)' % ' OR '.join(conditions))
+        if hosts:
+            where.append('host IN (%s)' % ', '.join('?' for host in hosts))
+            params.extend(hosts)
+        if since is not None:
+            where.append('t1 >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('t1 < ?')
+            params.append(until)
+        sql = 'SELECT path, host, t1, duration FROM consolidated'
+        if where:
+            sql += ' WHERE %s' % ' AND '.join(where)
+        sql += ' ORDER BY path, t1, rowid'
+        for path, host, t1, duration in self._connect().execute(sql, params):
+            yield path, '%s %s %s\n' % (timestamp_str(t1), host, duration)
@@ -0,0 +1,90 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import locale
+import os
+import os.path
+import sys
+
+from .Collator import collation_store
+from .Config import Config
+from .ConsolidationIndex import ConsolidationIndex
+from .UsageStats import UsageStats
+from .util import duration_str, timestamp_str
+
+class Stats(object):
+    """Reports usage rollups of the consolidated history, which are kept in a cache
+    updated by consolidation, so that only newly consolidated lines are read.  The
+    cache is rebuilt from all the consolidated history if it is missing."""
+
+    def __init__(self, args):
+        self._config = Config(args)
+        self._verbose = args.verbose
+        parser = argparse.ArgumentParser(prog='%s stats' % os.path.basename(sys.argv[0]),
+                                         description='report usage statistics of consolidated mount history')
+        parser.add_argument('--by', choices=['day', 'month'], default='month', help='period for rollups, default month')
+        parser.add_argument('--rebuild', action='store_true', help='rebuild the cache from all consolidated history')
+        self._args = parser.parse_args(args.args)
+        self._encoding = locale.getpreferredencoding(False)
+
+    def _rebuild(self, usage):
+        """Fold in all the consolidated files."""
+        consolidation_dir = self._config.consolidation_dir()
+        for path in ConsolidationIndex(consolidation_dir).consolidated_paths():
+            outpath = os.path.join(consolidation_dir, path.lstrip(os.sep))
+            if self._verbose:
+                sys.stdout.write('stats for %s\n' % outpath)
+            try:
+                with open(outpath, 'rb') as f:
+                    for rawline in f:
+                        usage.add(rawline.decode(self._encoding), path)
+            except FileNotFoundError:
+                pass
+
+    def _update_sqlite(self, usage):
+        """Fold in the rows consolidated since the last time."""
+        store = collation_store(self._config, self._verbose)
+        for rowid, path, host, t1, duration in store.consolidated_rows(usage.rowid):
+            usage.add_record(path, timestamp_str(t1), host, duration, t1)
+            usage.rowid = rowid
+        store.close()
+
+    def usage(self):
+        """Return the usage rollups, updating the cache first."""
+        cache_path = self._config.stats_cache_file
+        usage = UsageStats()
+        loaded = not self._args.rebuild and usage.load(cache_path)
+        if not loaded:
+            usage = UsageStats()
+        if self._config.collation_store == 'sqlite':
+            self._update_sqlite(usage)
+        elif not loaded:
+            self._rebuild(usage)
+        usage.save(cache_path)
+        return usage
+
+    def run(self):
+        usage = self.usage()
+        peaks = usage.peaks()
+        n = 8 if self._args.by == 'day' else 6
+        for period in sorted(p for p in usage.totals if len(p) == n):
+            scopes = usage.totals[period]
+            for scope in ('host', 'path'):
+                for name, (mounts, seconds) in sorted(scopes.get(scope, {}).items()):
+                    sys.stdout.write('%s %s %s %d %s\n' % (period, scope, name, mounts, duration_str(0, seconds)))
+            period_peaks = peaks.get(period, {})
+            for host in sorted(scopes.get('host', {})) + ['*']:
+                sys.stdout.write('%s peak %s %d\n' % (period, host, period_peaks.get(host, 0)))
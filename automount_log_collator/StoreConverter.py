@@ -0,0 +1,82 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+
+from .Collator import collation_store
+from .Config import Config
+from .TreeStore import TreeStore
+from .util import read_manifest, write_manifest
+
+class StoreConverter(object):
+    """Converts the collation trees of all hosts to the configured collation store.
+    Consolidated files are unaffected, but are also imported into a store which
+    holds consolidated history itself."""
+
+    def __init__(self, args):
+        self._config = Config(args)
+        self._verbose = args.verbose
+
+    def _histories(self, tree_sources, host):
+        """Generate path and open history file for each path with history on host."""
+        for path, host_sources in tree_sources.items():
+            history_path = host_sources.get(host)
+            if history_path is not None:
+                with open(history_path) as f:
+                    yield path, f
+
+    def convert(self):
+        if self._config.collation_store == 'tree':
+            sys.stderr.write('collation-store is "tree", nothing to convert\n')
+            return
+        tree = TreeStore(self._config, self._verbose)
+        store = collation_store(self._config, self._verbose)
+        for host in sorted(os.listdir(self._config.collation_dir())):
+            if host.startswith('.'):
+                continue
+            if self._verbose:
+                sys.stdout.write('converting %s\n' % host)
+            # the manifest is the only record of active mounts in other stores
+            manifest_path = self._config.active_manifest_file(host)
+            try:
+                read_manifest(manifest_path)
+            except (IOError, ValueError):
+                write_manifest(manifest_path, tree.load_active(host))
+            tree_sources = tree.consolidation_sources([host])
+            store.import_history(host, self._histories(tree_sources, host))
+            for path in tree_sources:
+                tree.remove_active(path, host)
+            tree.finalize_consolidation()
+        if self._config.collation_store == 'sqlite':
+            self._import_consolidated(store)
+        store.close()
+
+    def _import_consolidated(self, store):
+        if store.has_consolidated():
+            sys.stderr.write('consolidated history already imported, skipping consolidated files\n')
+            return
+        consolidation_dir = self._config.consolidation_dir()
+        for root, dirs, files in os.walk(consolidation_dir):
+            for filename in files:
+                if filename.startswith('.'):
+                    # the consolidation index and stats cache
+                    continue
+                outpath = os.path.join(root, filename)
+                path = os.sep + os.path.relpath(outpath, consolidation_dir)
+                if self._verbose:
+                    sys.stdout.write('importing consolidated %s\n' % path)
+                with open(outpath) as f:
+                    store.import_consolidated(path, f)
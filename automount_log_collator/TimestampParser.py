@@ -0,0 +1,98 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pendulum
+
+from .util import local_timestamp
+
+class TimestampParser(object):
+    """A TimestampParser converts syslog timestamps such as 'Oct  7 12:34:56' to
+    integer timestamps, for lines from a single logfile.
+
+    Syslog timestamps have no year, so this is inferred from the logfile date,
+    which is usually the same, except when we roll over from Dec to Jan.
+
+    The result is the same as pendulum.parse() on the year-qualified string in
+    the local timezone, but the month table and per-day lookup avoid a fuzzy
+    parse for every line."""
+
+    _months = {
+        'jan': 1, 'january': 1,
+        'feb': 2, 'february': 2,
+        'mar': 3, 'march': 3,
+        'apr': 4, 'april': 4,
+        'may': 5,
+        'jun': 6, 'june': 6,
+        'jul': 7, 'july': 7,
+        'aug': 8, 'august': 8,
+        'sep': 9, 'sept': 9, 'september': 9,
+        'oct': 10, 'october': 10,
+        'nov': 11, 'november': 11,
+        'dec': 12, 'december': 12,
+    }
+
+    def __init__(self, logfile_year, logfile_month):
+        self._logfile_year = logfile_year
+        self._logfile_month = logfile_month
+        self._days = {}         # (month, day) strings to (year, month, day, midnight timestamp), or None if not in table
+        self._last_s = None     # consecutive lines often share a timestamp
+        self._last = None
+
+    def year(self, timestamp_s):
+        """Return the year to use for the timestamp string."""
+        return self._logfile_year - 1 if timestamp_s.startswith('Dec') and self._logfile_month == 1 else self._logfile_year
+
+    def _day(self, timestamp_s, month_s, day_s):
+        month = self._months.get(month_s.lower())
+        if month is None:
+            return None
+        year = self.year(timestamp_s)
+        day = int(day_s)
+        midnight = local_timestamp(year, month, day)
+        # on days when the UTC offset changes, midnight is no use for computing other times
+        if local_timestamp(year, month, day, 23, 59, 59) - midnight != 86399:
+            midnight = None
+        return (year, month, day, midnight)
+
+    def _parse_slow(self, timestamp_s):
+        return pendulum.parse('%d %s' % (self.year(timestamp_s), timestamp_s),
+                              tz=pendulum.local_timezone(), strict=False).int_timestamp
+
+    def parse(self, timestamp_s):
+        """Return the integer timestamp for the timestamp string."""
+        if timestamp_s == self._last_s:
+            return self._last
+        fields = timestamp_s.split()
+        hms = fields[2].split(':') if len(fields) == 3 else []
+        if len(hms) == 3:
+            key = (fields[0], fields[1])
+            try:
+                day = self._days[key]
+            except KeyError:
+                day = self._day(timestamp_s, fields[0], fields[1])
+                self._days[key] = day
+        else:
+            day = None
+        if day is not None:
+            hour, minute, second = int(hms[0]), int(hms[1]), int(hms[2])
+            if day[3] is not None and hour < 24 and minute < 60 and second < 60:
+                t = day[3] + hour * 3600 + minute * 60 + second
+            else:
+                t = local_timestamp(day[0], day[1], day[2], hour, minute, second)
+        else:
+            t = self._parse_slow(timestamp_s)
+        self._last_s = timestamp_s
+        self._last = t
+        return t
@@ -0,0 +1,125 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import sys
+
+from .HistoryAppender import HistoryAppender
+from .Inventory import Inventory
+from .util import timestamp_str, timestamp_from_str, prune_empty_dirs, escape_path, unescape_path
+
+class TreeStore(object):
+    """The original collation store, a directory tree per host, with a directory
+    for each mount path, containing its active and history files."""
+
+    def __init__(self, config, verbose, history=None):
+        self._config = config
+        self._verbose = verbose
+        self._history = history if history is not None else HistoryAppender()
+        self._emptied_dirs = {}    # host -> directories we removed files from, which may need pruning
+        self._inventory = None
+
+    def host_history_path(self, host, path):
+        """Return the path to the mount history file."""
+        return os.path.join(self._config.host_collation_dir(host), escape_path(path), 'history')
+
+    def host_active_path(self, host, path):
+        """Return the path to the active mount file."""
+        return os.path.join(self._config.host_collation_dir(host), escape_path(path), 'active')
+
+    def _path_from_mounts_filepath(self, filepath, host=None):
+        """Return the path represented by the active or history file."""
+        return os.path.dirname(unescape_path(filepath[len(self._config.host_collation_dir(host)):]))
+
+    def load_active(self, host=None):
+        """Return the active mounts and their timestamps for host, from the active files."""
+        mounts = {}
+        for root, dirs, files in os.walk(self._config.host_collation_dir(host)):
+            if 'active' in files:
+                # read actual file, and path for mount, and its timestamp
+                filepath = os.path.join(root, 'active')
+                path = self._path_from_mounts_filepath(filepath, host)
+                with open(filepath, 'r') as f:
+                    for line in f:
+                        mounts[path] = timestamp_from_str(line)
+        return mounts
+
+    def save_active(self, mounts, now, host=None):
+        """Write the active files for new or changed mounts on host, and mark them as in use at now,
+        returning how many were written."""
+        for path, t0 in mounts.items():
+            active_path = self.host_active_path(host, path)
+            os.makedirs(os.path.dirname(active_path), exist_ok=True)
+            with open(active_path, 'w') as f:
+                f.write('%s\n' % timestamp_str(t0))
+                if self._verbose:
+                    sys.stdout.write('save mount %s at %s\n' % (path, timestamp_str(t0)))
+            # set timestamp of collated file to now, to indicate that it is still in use
+            history_path = self.host_history_path(host, path)
+            if not os.path.exists(history_path):
+                # create empty file, so we can touch it
+                open(history_path, 'a').close()
+            os.utime(history_path, (now, now))
+        return len(mounts)
+
+    def remove_active(self, path, host=None):
+        """Remove the active file for a persisted mount which has been unmounted."""
+        active_path = self.host_active_path(host, path)
+        if os.path.exists(active_path):
+            if self._verbose:
+                sys.stdout.write('remove active mount file %s\n' % path)
+            os.remove(active_path)
+            self._emptied_dirs.setdefault(host, set()).add(os.path.dirname(active_path))
+
+    def append(self, path, t1, host, duration):
+        """Append an unmount record to the history for path."""
+        self._history.append(self.host_history_path(host, path), '%s %s %s\n' % (timestamp_str(t1), host, duration), t1)
+
+    def flush(self):
+        self._history.flush()
+
+    def close(self):
+        """Flush history, and remove the directories we emptied, and any ancestors that leaves empty,
+        returning how many were removed."""
+        self._history.flush()
+        n = 0
+        for host, emptied_dirs in self._emptied_dirs.items():
+            n += prune_empty_dirs(emptied_dirs, self._config.host_collation_dir(host))
+        self._emptied_dirs.clear()
+        return n
+
+    def consolidation_sources(self, hosts):
+        """Return a dict of path to {host: history file, or None if it only has an active file}."""
+        # a single pass over the collation trees, for both merging and finalizing
+        self._inventory = Inventory([ (host, self._config.host_collation_dir(host)) for host in hosts ])
+        return { path: { host: self.host_history_path(host, path) if 'history' in files else None
+                         for host, files in self._inventory.paths[path].items() }
+                 for path in self._inventory.paths }
+
+    def active_timestamp(self, host, path):
+        """Return the time of the active file for path on host, or None if there isn't one."""
+        active_path = self.host_active_path(host, path)
+        if os.path.exists(active_path):
+            return os.stat(active_path).st_mtime
+        return None
+
+    def finalize_consolidation(self):
+        """Ensure the history files don't get consolidated again, by removing them,
+        returning how many directories that left empty were removed."""
+        for path in self._inventory.paths:
+            for host in self._inventory.hosts(path, 'history'):
+                os.remove(self.host_history_path(host, path))
+        return self._inventory.prune_empty_dirs()
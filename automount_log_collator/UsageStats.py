@@ -0,0 +1,200 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import json
+import os
+import os.path
+import time
+
+from .util import duration_seconds, timestamp_from_str
+
+class UsageStats(object):
+    """Usage rollups of mount history, which are, for each day and month, the
+    number of mounts and total mounted duration for each path and host, and the
+    peak number of concurrent mounts on each host and over all hosts.
+
+    Peaks are derived from sparse concurrency deltas, +1 at each mount and -1 at
+    each unmount, kept per host and day, so that lines may be folded in in any
+    order, and the rollups of separately merged paths combined.
+
+    So that the deltas don't grow with the whole history, days more than
+    open_days before the latest are frozen when the rollups are saved, keeping
+    just their peaks, and each host's level at the end of the last frozen day.
+    Lines which arrive later than that still count in the totals, and in the
+    levels of the days which follow, but no longer in the peaks of frozen days."""
+
+    open_days = 31
+
+    def __init__(self, path=None):
+        self.path = path        # the mount path of lines added without one
+        self.totals = {}        # YYYYMMDD or YYYYMM -> 'host' or 'path' -> name -> [mounts, seconds]
+        self.deltas = {}        # host -> YYYYMMDD -> timestamp string -> delta
+        self.frozen_until = None        # the last frozen day, if any
+        self.frozen_levels = {}         # host -> level at the end of the last frozen day
+        self.frozen_peaks = {}          # YYYYMMDD -> host -> peak, for frozen days
+        self.rowid = 0          # the last row folded in from an SQLite store
+
+    def add(self, line, path=None):
+        """Fold in a history line for path."""
+        fields = line.split()
+        if len(fields) >= 3:
+            self.add_record(path if path is not None else self.path, fields[0], fields[1], fields[2])
+
+    def add_record(self, path, key, host, duration, t1=None):
+        """Fold in an unmount of path on host at the time whose merge key is given, or t1 if known."""
+        seconds = duration_seconds(duration)
+        if seconds is not None and seconds <= 0:
+            seconds = None
+        for period in (key[:8], key[:6]):
+            scopes = self.totals.setdefault(period, {})
+            for scope, name in (('host', host), ('path', path)):
+                total = scopes.setdefault(scope, {}).setdefault(name, [0, 0])
+                total[0] += 1
+                if seconds is not None:
+                    total[1] += seconds
+        if seconds is not None:
+            if t1 is None:
+                t1 = timestamp_from_str(key)
+            t0 = t1 - seconds
+            self._add_host_delta(host, time.strftime('%Y%m%d', time.localtime(t0)), t0, 1)
+            self._add_host_delta(host, key[:8], t1, -1)
+
+    def _add_host_delta(self, host, day, t, delta):
+        if self.frozen_until is not None and day <= self.frozen_until:
+            # too late for the peaks of that day, but not for the level after it
+            self.frozen_levels[host] = self.frozen_levels.get(host, 0) + delta
+        else:
+            self._add_delta(self.deltas.setdefault(host, {}), day, t, delta)
+
+    @staticmethod
+    def _add_delta(host_deltas, day, t, delta):
+        day_deltas = host_deltas.setdefault(day, {})
+        t_s = str(t)
+        delta += day_deltas.get(t_s, 0)
+        if delta == 0:
+            # keep them sparse
+            day_deltas.pop(t_s, None)
+        else:
+            day_deltas[t_s] = delta
+
+    def update(self, other):
+        """Fold in the rollups from other, which has no frozen days."""
+        for period, scopes in other.totals.items():
+            for scope, names in scopes.items():
+                totals = self.totals.setdefault(period, {}).setdefault(scope, {})
+                for name, (mounts, seconds) in names.items():
+                    total = totals.setdefault(name, [0, 0])
+                    total[0] += mounts
+                    total[1] += seconds
+        for host, days in other.deltas.items():
+            for day, day_deltas in days.items():
+                for t_s, delta in day_deltas.items():
+                    self._add_host_delta(host, day, t_s, delta)
+
+    @staticmethod
+    def _day_peaks(days, host_deltas, level=0):
+        """Return the peak concurrency for each of days, and any other days with deltas,
+        carrying the level over from earlier days, starting from level, and the level
+        at the end."""
+        peaks = {}
+        for day in sorted(set(days) | set(host_deltas)):
+            peak = level
+            for t, delta in sorted((int(t_s), delta) for t_s, delta in host_deltas.get(day, {}).items()):
+                level += delta
+                if level > peak:
+                    peak = level
+            peaks[day] = peak
+        return peaks, level
+
+    def _host_deltas(self):
+        """Return the deltas and starting level for each host, and over all hosts as host '*'."""
+        all_deltas = {}
+        for host_deltas in self.deltas.values():
+            for day, day_deltas in host_deltas.items():
+                for t_s, delta in day_deltas.items():
+                    self._add_delta(all_deltas, day, t_s, delta)
+        hosts = sorted(set(self.deltas) | set(self.frozen_levels))
+        return ([ (host, self.deltas.get(host, {}), self.frozen_levels.get(host, 0)) for host in hosts ] +
+                [ ('*', all_deltas, sum(self.frozen_levels.values())) ])
+
+    def _open_days(self):
+        return [ period for period in self.totals
+                 if len(period) == 8 and (self.frozen_until is None or period > self.frozen_until) ]
+
+    def peaks(self):
+        """Return the peak concurrency, as period -> host -> peak, with the peak over all hosts as host '*'."""
+        peaks = {}
+        def add_peak(day, host, peak):
+            peaks.setdefault(day, {})[host] = peak
+            month_peaks = peaks.setdefault(day[:6], {})
+            month_peaks[host] = max(peak, month_peaks.get(host, 0))
+        for day, day_peaks in self.frozen_peaks.items():
+            for host, peak in day_peaks.items():
+                add_peak(day, host, peak)
+        days = self._open_days()
+        for host, host_deltas, level in self._host_deltas():
+            for day, peak in self._day_peaks(days, host_deltas, level)[0].items():
+                add_peak(day, host, peak)
+        return peaks
+
+    def freeze(self):
+        """Freeze the days more than open_days before the latest day."""
+        days = [ period for period in self.totals if len(period) == 8 ]
+        if not days:
+            return
+        latest = datetime.datetime.strptime(max(days), '%Y%m%d').date()
+        until = (latest - datetime.timedelta(days=self.open_days)).strftime('%Y%m%d')
+        if self.frozen_until is not None and until <= self.frozen_until:
+            return
+        freezing = [ day for day in self._open_days() if day <= until ]
+        for host, host_deltas, level in self._host_deltas():
+            closing = { day: day_deltas for day, day_deltas in host_deltas.items() if day <= until }
+            day_peaks, level = self._day_peaks(freezing, closing, level)
+            for day, peak in day_peaks.items():
+                self.frozen_peaks.setdefault(day, {})[host] = peak
+            if host != '*':
+                self.frozen_levels[host] = level
+                for day in closing:
+                    del host_deltas[day]
+                if not host_deltas:
+                    self.deltas.pop(host, None)
+        self.frozen_until = until
+
+    def load(self, cache_path):
+        """Load the rollups from the cache, returning whether it was found and valid."""
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+            self.totals = cache['totals']
+            self.deltas = cache['deltas']
+            self.frozen_until = cache['frozen_until']
+            self.frozen_levels = cache['frozen_levels']
+            self.frozen_peaks = cache['frozen_peaks']
+            self.rowid = cache['rowid']
+            return True
+        except (IOError, ValueError, KeyError):
+            return False
+
+    def save(self, cache_path):
+        """Freeze the days which are done with, and atomically replace the cache."""
+        self.freeze()
+        cache_path_new = '%s.new' % cache_path
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path_new, 'w') as f:
+            json.dump({ 'totals': self.totals, 'deltas': self.deltas, 'frozen_until': self.frozen_until,
+                        'frozen_levels': self.frozen_levels, 'frozen_peaks': self.frozen_peaks,
+                        'rowid': self.rowid }, f, sort_keys=True)
+        os.rename(cache_path_new, cache_path)
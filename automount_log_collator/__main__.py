@@ -16,21 +16,33 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import cProfile
 import sys
 
 from automount_log_collator.Config import ConfigError
+from automount_log_collator.Exporter import Exporter
 from automount_log_collator.Merger import Merger
+from automount_log_collator.Query import Query
 from automount_log_collator.Scanner import Scanner
+from automount_log_collator.Stats import Stats
+from automount_log_collator.StoreConverter import StoreConverter
 from automount_log_collator.version import get_version
 
 def main():
     parser = argparse.ArgumentParser(description='collate automount logfiles')
     parser.add_argument('-v', '--verbose', action='store_true', help='verbose output')
     parser.add_argument('-c', '--config', metavar='FILE', help='configuration file')
-    parser.add_argument('command', choices=['collate','consolidate','list-files','list-packages','list-excluded','purge-excluded','version'], help='command to run')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--metrics', metavar='FILE', help='write phase timings and counters for collate or consolidate, as JSON, or Prometheus textfile if FILE ends with .prom')
+    parser.add_argument('--profile', metavar='FILE', help='write cProfile statistics for the run')
+    parser.add_argument('command', choices=['collate','consolidate','convert-store','query','list-files','stats','export','list-packages','list-excluded','purge-excluded','version'], help='command to run')
     parser.add_argument('args', nargs=argparse.REMAINDER, help='command arguments')
     args = parser.parse_args()
 
+    profile = None
+    if args.profile is not None:
+        profile = cProfile.Profile()
+        profile.enable()
     try:
         if args.command == 'version':
             print('automount-log-collator v%s' % get_version())
@@ -40,9 +52,28 @@ def main():
         elif args.command == 'collate':
             scanner = Scanner(args)
             scanner.scan()
+        elif args.command == 'query':
+            query = Query(args)
+            query.run()
+        elif args.command == 'list-files':
+            query = Query(args)
+            query.list_files()
+        elif args.command == 'stats':
+            stats = Stats(args)
+            stats.run()
+        elif args.command == 'export':
+            exporter = Exporter(args)
+            exporter.export()
+        elif args.command == 'convert-store':
+            converter = StoreConverter(args)
+            converter.convert()
     except ConfigError as e:
         sys.stderr.write('%s\n' % e)
         sys.exit(1)
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(args.profile)
 
 if __name__ == '__main__':
     main()
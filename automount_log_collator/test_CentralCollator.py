@@ -0,0 +1,81 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import resource
+import tempfile
+import unittest
+
+from .CentralCollator import CentralCollator, host_partition
+from .Event import Event
+from .Metrics import Metrics
+from .testing import CollationTestCase
+from .util import escape_path, timestamp_from_str
+
+class TestCentralCollator(CollationTestCase):
+
+    def collate(self, jobs, events):
+        collator = CentralCollator(self.config, False, Metrics('collate'), jobs)
+        try:
+            n = collator.collate([ Event(action, timestamp_from_str(t), path, host) for action, t, path, host in events ])
+            collator.finalize()
+        finally:
+            collator.close()
+        return n
+
+    def history(self, host, path):
+        with open(os.path.join(self.collation_dir, host, escape_path(path), 'history')) as f:
+            return f.read()
+
+    def test_hosts(self):
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs), tempfile.TemporaryDirectory() as tmpdir:
+                self.make_config(tmpdir)
+                n = self.collate(jobs, [('mounted', '20190101-00:00:00', '/home/a', 'h1.example.org'),
+                                        ('mounted', '20190101-00:10:00', '/home/a', 'h2'),
+                                        ('expired', '20190101-01:00:00', '/home/a', 'h1.example.org'),
+                                        ('mounted', '20190101-02:00:00', '/home/b', 'h1')])
+                self.assertEqual(n, 4)
+                self.assertEqual(self.history('h1', '/home/a'), '20190101-01:00:00 h1 1:00\n')
+                self.assertTrue(os.path.exists(os.path.join(self.collation_dir, 'h2', escape_path('/home/a'), 'active')))
+                for host, last in (('h1', '20190101-02:00:00'), ('h2', '20190101-00:10:00')):
+                    with open(os.path.join(self.collation_dir, '.%s.collated' % host)) as f:
+                        self.assertEqual(f.readline().strip(), last)
+                with open(self.config.central_collation_file) as f:
+                    self.assertEqual(f.readline().strip(), '20190101-02:00:00')
+
+    def test_many_hosts(self):
+        # more history files than can be open at once, with only a few mounts active on each host
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(256, soft), hard))
+        try:
+            events = []
+            for i in range(30):
+                for j in range(70):
+                    events.append(('mounted', '20190101-00:%02d:00' % (j % 60), '/home/u%d' % j, 'h%d' % i))
+                    events.append(('expired', '20190101-01:%02d:00' % (j % 60), '/home/u%d' % j, 'h%d' % i))
+            self.assertEqual(self.collate(1, events), 4200)
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+        self.assertEqual(self.history('h29', '/home/u69'), '20190101-01:09:00 h29 1:00\n')
+
+    def test_host_partition(self):
+        self.assertEqual(host_partition('h1', 1), 0)
+        self.assertEqual(host_partition('h1', 4), host_partition('h1', 4))
+        self.assertTrue(all(0 <= host_partition('h%d' % i, 3) < 3 for i in range(20)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import unittest
+
+from .Collator import Collator
+from .testing import CollationTestCase
+from .util import bare_hostname, escape_path, timestamp_from_str
+
+class TestCollator(CollationTestCase):
+
+    def mounts_path(self, path, filename):
+        return os.path.join(self.config.host_collation_dir(), escape_path(path), filename)
+
+    def history(self, path):
+        with open(self.mounts_path(path, 'history')) as f:
+            return f.read()
+
+    def manifest(self):
+        with open(self.config.active_manifest_file()) as f:
+            return f.read()
+
+    def collate_mount(self):
+        collator = Collator(self.config, False)
+        collator.mount(timestamp_from_str('20190101-00:00:00'), '/home/a')
+        collator.finalize()
+        self.assertEqual(self.manifest(), '20190101-00:00:00 /home/a\n')
+
+    def collate_unmount(self):
+        collator = Collator(self.config, False)
+        collator.unmount(timestamp_from_str('20190101-01:00:00'), '/home/a')
+        collator.finalize()
+        self.assertEqual(self.history('/home/a'), '20190101-01:00:00 %s 1:00\n' % bare_hostname())
+        self.assertEqual(self.manifest(), '')
+
+    def test_manifest(self):
+        self.collate_mount()
+        # the manifest is enough, without walking the tree for active files
+        os.remove(self.mounts_path('/home/a', 'active'))
+        self.collate_unmount()
+
+    def test_missing_manifest(self):
+        self.collate_mount()
+        os.remove(self.config.active_manifest_file())
+        # the active files are walked instead, and the manifest rebuilt from them
+        Collator(self.config, False)
+        self.assertEqual(self.manifest(), '20190101-00:00:00 /home/a\n')
+        self.collate_unmount()
+
+    def test_bad_manifest(self):
+        self.collate_mount()
+        with open(self.config.active_manifest_file(), 'w') as f:
+            f.write('garbage\n')
+        Collator(self.config, False)
+        self.assertEqual(self.manifest(), '20190101-00:00:00 /home/a\n')
+        self.collate_unmount()
+
+    def test_changed_only(self):
+        self.collate_mount()
+        active_path = self.mounts_path('/home/a', 'active')
+        os.utime(active_path, (0, 0))
+        collator = Collator(self.config, False)
+        collator.mount(timestamp_from_str('20190101-02:00:00'), '/home/b')
+        collator.finalize()
+        # an unchanged mount isn't rewritten, but a new one is
+        self.assertEqual(os.stat(active_path).st_mtime, 0)
+        self.assertTrue(os.path.exists(self.mounts_path('/home/b', 'active')))
+        # but a remount changes it
+        collator.mount(timestamp_from_str('20190101-03:00:00'), '/home/a')
+        collator.finalize()
+        with open(active_path) as f:
+            self.assertEqual(f.read(), '20190101-03:00:00\n')
+
+if __name__ == '__main__':
+    unittest.main()
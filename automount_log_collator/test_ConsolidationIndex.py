@@ -0,0 +1,128 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import contextlib
+import io
+import os
+import os.path
+import tempfile
+import unittest
+
+from .Collator import Collator
+from .ConsolidationIndex import ConsolidationIndex, IndexEntryBuilder
+from .Merger import Merger, merge_consolidated
+from .Query import Query
+from .testing import CollationTestCase
+from .util import timestamp_from_str
+
+class SmallIndexEntryBuilder(IndexEntryBuilder):
+    spacing = 100
+
+class TestConsolidationIndex(CollationTestCase):
+
+    def lines(self, start, n):
+        return [ '201901%02d-00:00:00 host%d 1:00\n' % (day, day) for day in range(start, start + n) ]
+
+    def test_builder(self):
+        builder = SmallIndexEntryBuilder(Merger.key)
+        for line in self.lines(1, 10):
+            builder.add(line)
+        entry = builder.entry()
+        self.assertEqual(entry['first'], '20190101-00:00:00')
+        self.assertEqual(entry['last'], '20190110-00:00:00')
+        self.assertEqual(entry['size'], sum(len(line) for line in self.lines(1, 10)))
+        self.assertEqual([ offset for key, offset in entry['offsets'] ], [0, 116, 232])
+        self.assertEqual(entry['offsets'][1][0], '20190105-00:00:00')
+
+        self.assertEqual(ConsolidationIndex.seek_offset(entry, '20190101-00:00:00'), 0)
+        self.assertEqual(ConsolidationIndex.seek_offset(entry, '20190105-00:00:00'), 0)
+        self.assertEqual(ConsolidationIndex.seek_offset(entry, '20190106-00:00:00'), 116)
+        self.assertEqual(ConsolidationIndex.seek_offset(entry, '20190131-00:00:00'), 232)
+
+        # continuing an entry for appended lines is the same as building it all at once
+        builder = SmallIndexEntryBuilder(Merger.key)
+        for line in self.lines(1, 5):
+            builder.add(line)
+        builder = SmallIndexEntryBuilder(Merger.key, builder.entry())
+        for line in self.lines(6, 5):
+            builder.add(line)
+        self.assertEqual(builder.entry(), entry)
+
+    def test_merge(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            outpath = os.path.join(tmpdir, 'consolidated', 'home', 'u')
+            entry, usage, rewritten = merge_consolidated(outpath, [self.lines(1, 5)], None, False)
+            index = ConsolidationIndex(os.path.join(tmpdir, 'consolidated'))
+            index.entries['/home/u'] = entry
+            index.save()
+            index = ConsolidationIndex(os.path.join(tmpdir, 'consolidated'))
+            self.assertTrue(index.load())
+            entry = index.valid_entry('/home/u', outpath)
+            self.assertIsNotNone(entry)
+            entry, usage, rewritten = merge_consolidated(outpath, [self.lines(6, 5)], None, False, entry)
+            self.assertFalse(rewritten)
+            self.assertEqual(entry, IndexEntryBuilder.scan(Merger.key, outpath).entry())
+            self.assertEqual(entry['last'], '20190110-00:00:00')
+
+    def query(self, command, *args):
+        query = Query(argparse.Namespace(config=self.config_path, verbose=False, args=list(args)))
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            getattr(query, command)()
+        return out.getvalue()
+
+    def test_first_index(self):
+        # consolidated before there was an index, and not merged into again
+        oldpath = os.path.join(self.consolidation_dir, 'home', 'old')
+        os.makedirs(os.path.dirname(oldpath))
+        with open(oldpath, 'w') as f:
+            f.writelines(self.lines(1, 2))
+        history_path = os.path.join(self.collation_dir, 'h', '_home', '_new', 'history')
+        os.makedirs(os.path.dirname(history_path))
+        with open(history_path, 'w') as f:
+            f.writelines(self.lines(3, 2))
+        Merger(self.args).merge()
+        index = ConsolidationIndex(self.consolidation_dir)
+        self.assertTrue(index.load())
+        self.assertEqual(sorted(index.entries), ['/home/new', '/home/old'])
+        self.assertEqual(index.valid_entry('/home/old', oldpath), IndexEntryBuilder.scan(Merger.key, oldpath).entry())
+        self.assertEqual(self.query('list_files'), '/home/new\n/home/old\n')
+        self.assertEqual(self.query('run', '--until', '20190102', '/home'),
+                         '/home/old 20190101-00:00:00 host1 1:00\n')
+
+    def test_active_only(self):
+        # mounted but not yet expired, so consolidated with no lines
+        collator = Collator(self.config, False, hostname='h')
+        collator.mount(timestamp_from_str('20190101-00:00:00'), '/home/c')
+        collator.finalize()
+        Merger(self.args).merge()
+        index = ConsolidationIndex(self.consolidation_dir)
+        self.assertTrue(index.load())
+        self.assertEqual(index.entries, { '/home/c': { 'first': None, 'last': None, 'size': 0, 'offsets': [] } })
+        self.assertEqual(self.query('list_files'), '/home/c\n')
+        self.assertEqual(self.query('run', '--since', '20190101'), '')
+        # and its entry is continued once it expires
+        collator = Collator(self.config, False, hostname='h')
+        collator.unmount(timestamp_from_str('20190101-01:00:00'), '/home/c')
+        collator.finalize()
+        Merger(self.args).merge()
+        index = ConsolidationIndex(self.consolidation_dir)
+        self.assertTrue(index.load())
+        self.assertEqual(index.entries['/home/c'], IndexEntryBuilder.scan(Merger.key, os.path.join(self.consolidation_dir, 'home', 'c')).entry())
+        self.assertEqual(index.entries['/home/c']['first'], '20190101-01:00:00')
+        self.assertEqual(self.query('run', '--since', '20190101'), '/home/c 20190101-01:00:00 h 1:00\n')
+
+if __name__ == '__main__':
+    unittest.main()
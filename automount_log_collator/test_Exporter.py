@@ -0,0 +1,95 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import contextlib
+import io
+import os
+import os.path
+import unittest
+import unittest.mock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .Exporter import Exporter
+from .testing import CollationTestCase
+from .util import timestamp_from_str
+
+@unittest.skipIf(np is None, 'NumPy is not installed')
+class TestExporter(CollationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_consolidated('/home/a', ['20190101-00:00:00 h1 1:00\n', '20190102-00:00:00 h2 unknown\n'])
+        self.write_consolidated('/home/b', ['20190103-00:00:00 h2 1d-0:30\n'])
+
+    def write_consolidated(self, path, lines):
+        outpath = os.path.join(self.consolidation_dir, path.lstrip('/'))
+        os.makedirs(os.path.dirname(outpath), exist_ok=True)
+        with open(outpath, 'w') as f:
+            f.writelines(lines)
+
+    def export(self, output, chunksize=Exporter.chunksize):
+        exporter = Exporter(argparse.Namespace(config=self.config_path, verbose=False, args=[output]))
+        exporter.chunksize = chunksize
+        exporter.export()
+
+    def check(self, arrays):
+        self.assertEqual(list(arrays['t1']), [ timestamp_from_str(s) for s in
+                                               ['20190101-00:00:00', '20190102-00:00:00', '20190103-00:00:00'] ])
+        self.assertEqual(list(arrays['duration']), [3600, -1, 86400 + 1800])
+        self.assertEqual(list(arrays['hosts'][arrays['host']]), ['h1', 'h2', 'h2'])
+        self.assertEqual(list(arrays['paths'][arrays['path']]), ['/home/a', '/home/a', '/home/b'])
+
+    def test_npy(self):
+        outdir = os.path.join(self._tmpdir.name, 'export')
+        # chunks smaller than the history
+        self.export(outdir, chunksize=2)
+        self.check({ name: np.load(os.path.join(outdir, '%s.npy' % name), mmap_mode='r')
+                     for name in ['t1', 'duration', 'host', 'path', 'hosts', 'paths'] })
+
+    def test_malformed(self):
+        # lines which aren't rows are neither counted nor exported
+        self.write_consolidated('/home/a', ['20190101-00:00:00 h1 1:00\n', '/\n', '20190101-02:00:00 h1\n', '\n',
+                                            '20190102-00:00:00 h2 unknown\n'])
+        outdir = os.path.join(self._tmpdir.name, 'export')
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            self.export(outdir)
+        self.assertNotIn('changed during export', err.getvalue())
+        self.check({ name: np.load(os.path.join(outdir, '%s.npy' % name))
+                     for name in ['t1', 'duration', 'host', 'path', 'hosts', 'paths'] })
+
+    def test_shrunk(self):
+        # fewer rows than were counted, as if the history changed between the passes
+        outdir = os.path.join(self._tmpdir.name, 'export')
+        with unittest.mock.patch.object(Exporter, '_count_file_rows', return_value=5), \
+             contextlib.redirect_stderr(io.StringIO()) as err:
+            self.export(outdir, chunksize=2)
+        self.assertIn('warning: consolidated history changed during export, exported 3 of 5 rows\n', err.getvalue())
+        self.check({ name: np.load(os.path.join(outdir, '%s.npy' % name))
+                     for name in ['t1', 'duration', 'host', 'path', 'hosts', 'paths'] })
+        self.assertEqual(sorted(os.listdir(outdir)), [ '%s.npy' % name for name in ['duration', 'host', 'hosts', 'path', 'paths', 't1'] ])
+
+    def test_npz(self):
+        output = os.path.join(self._tmpdir.name, 'export.npz')
+        self.export(output)
+        with np.load(output) as arrays:
+            self.check(arrays)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import tempfile
+import unittest
+
+from .HistoryAppender import HistoryAppender
+
+class TestHistoryAppender(unittest.TestCase):
+
+    def test_append(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = [ os.path.join(tmpdir, '_x%d' % i, 'history') for i in range(3) ]
+            appender = HistoryAppender(maxopen=2)
+            for i in range(4):
+                for j, path in enumerate(paths):
+                    appender.append(path, 'line %d\n' % i, 1000 * j + i)
+            appender.flush()
+            for j, path in enumerate(paths):
+                with open(path) as f:
+                    self.assertEqual(f.read(), 'line 0\nline 1\nline 2\nline 3\n')
+                self.assertEqual(os.stat(path).st_mtime, 1000 * j + 3)
+
+if __name__ == '__main__':
+    unittest.main()
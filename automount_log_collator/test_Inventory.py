@@ -0,0 +1,49 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import tempfile
+import unittest
+
+from .Inventory import Inventory
+
+class TestInventory(unittest.TestCase):
+
+    def test_inventory(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for host, escaped_path, filenames in [
+                    ('a', '_home/_u1', ['history', 'active']),
+                    ('a', '_home/_u2', ['history']),
+                    ('a', '_proj/_p1/_sub', ['active']),
+                    ('b', '_home/_u1', ['history']),
+                    ('b', '_empty/_dir', []) ]:
+                dirpath = os.path.join(tmpdir, host, escaped_path)
+                os.makedirs(dirpath)
+                for filename in filenames:
+                    open(os.path.join(dirpath, filename), 'w').close()
+            inventory = Inventory([ (host, os.path.join(tmpdir, host)) for host in ['a', 'b'] ])
+            self.assertEqual(sorted(inventory.paths), ['/home/u1', '/home/u2', '/proj/p1/sub'])
+            self.assertEqual(sorted(inventory.hosts('/home/u1')), ['a', 'b'])
+            self.assertEqual(inventory.hosts('/home/u2', 'active'), [])
+            self.assertEqual(inventory.hosts('/proj/p1/sub', 'active'), ['a'])
+
+            os.remove(os.path.join(tmpdir, 'b', '_home', '_u1', 'history'))
+            inventory.prune_empty_dirs()
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['a'])
+            self.assertTrue(os.path.isdir(os.path.join(tmpdir, 'a', '_home', '_u2')))
+
+if __name__ == '__main__':
+    unittest.main()
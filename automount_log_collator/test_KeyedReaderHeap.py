@@ -0,0 +1,86 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+import tempfile
+import unittest
+
+from .KeyedReader import KeyedReader
+from .KeyedReaderHeap import KeyedReaderHeap
+from .KeyedReaderTree import KeyedReaderTree
+
+def first_field(line):
+    return line.split(maxsplit=1)[0]
+
+class TestKeyedReaderHeap(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def write_files(self, contents):
+        paths = []
+        for i, lines in enumerate(contents):
+            path = os.path.join(self._tmpdir.name, 'f%d' % i)
+            with open(path, 'w') as f:
+                for line in lines:
+                    f.write('%s\n' % line)
+            paths.append(path)
+        return paths
+
+    def merge(self, merger, paths):
+        for path in paths:
+            merger.insert(KeyedReader(path, first_field))
+        return list(merger.lines())
+
+    def test_merge(self):
+        paths = self.write_files([
+            ['1 a', '4 a', '7 a'],
+            [],
+            ['2 c', '3 c', '8 c'],
+            ['5 d'],
+        ])
+        krh = KeyedReaderHeap()
+        self.assertEqual(self.merge(krh, paths), ['1 a\n', '2 c\n', '3 c\n', '4 a\n', '5 d\n', '7 a\n', '8 c\n'])
+        self.assertEqual(krh.n, 4)
+        self.assertEqual(krh.lastkey, '8')
+
+    def test_empty(self):
+        krh = KeyedReaderHeap()
+        self.assertEqual(list(krh.lines()), [])
+        self.assertEqual(krh.n, 0)
+        self.assertIsNone(krh.lastkey)
+
+    def test_stable(self):
+        paths = self.write_files([ ['1 %d' % i, '2 %d' % i] for i in range(5) ])
+        self.assertEqual(self.merge(KeyedReaderHeap(), paths),
+                         [ '1 %d\n' % i for i in range(5) ] + [ '2 %d\n' % i for i in range(5) ])
+
+    def test_same_as_tree(self):
+        # distinct keys, since the tree doesn't keep ties in insertion order
+        rng = random.Random(1)
+        keys = rng.sample(range(100000), 1000)
+        contents = [ [ '%06d %d' % (k, i) for k in sorted(keys[i::20]) ] for i in range(20) ]
+        paths = self.write_files(contents)
+        krt = KeyedReaderTree()
+        krh = KeyedReaderHeap()
+        self.assertEqual(self.merge(krh, paths), self.merge(krt, paths))
+        self.assertEqual(krh.lastkey, krt.lastkey)
+
+if __name__ == '__main__':
+    unittest.main()
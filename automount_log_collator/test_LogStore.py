@@ -0,0 +1,82 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import unittest
+
+from .LogStore import LogStore
+from .Merger import Merger
+from .testing import CollationTestCase
+from .util import timestamp_from_str, write_manifest
+
+class TestLogStore(CollationTestCase):
+
+    collation_store = 'log'
+
+    def append(self, records):
+        store = LogStore(self.config, False)
+        for path, timestamp_s, host, duration in records:
+            store.append(path, timestamp_from_str(timestamp_s), host, duration)
+        store.close()
+        return store
+
+    def test_segments(self):
+        store = self.append([('/home/a b', '20190102-00:00:00', 'h', '1:00'),
+                             ('/home/c', '20190101-00:00:00', 'h', '0:30')])
+        self.append([])
+        index = store.read_index('h')
+        self.assertEqual(len(index), 1)
+        segment, n, first, last = index[0]
+        self.assertEqual((n, first, last), (2, '20190101-00:00:00', '20190102-00:00:00'))
+        self.assertEqual(sorted(os.listdir(self.config.host_collation_dir('h'))), ['index', 'lock', segment])
+
+        host = 'h'
+        write_manifest(self.config.active_manifest_file(host), { '/home/d': timestamp_from_str('20190103-00:00:00') })
+        self.assertEqual(store.consolidation_sources([host]), {
+            '/home/a b': { host: ['20190102-00:00:00 h 1:00\n'] },
+            '/home/c': { host: ['20190101-00:00:00 h 0:30\n'] },
+            '/home/d': { host: [] },
+        })
+        store.finalize_consolidation()
+        self.assertEqual(store.read_index('h'), [])
+        self.assertEqual(sorted(os.listdir(self.config.host_collation_dir('h'))), ['index', 'lock'])
+
+    def test_collate_during_consolidation(self):
+        self.append([('/home/u', '20190101-00:00:00', 'h', '1:00')])
+        store = LogStore(self.config, False)
+        consumed = [ entry[0] for entry in store.read_index('h') ]
+        self.assertEqual(list(store.consolidation_sources(['h'])), ['/home/u'])
+        self.append([('/home/v', '20190102-00:00:00', 'h', '1:00')])
+        store.finalize_consolidation()
+        index = store.read_index('h')
+        self.assertEqual([ entry[1:] for entry in index ], [(1, '20190102-00:00:00', '20190102-00:00:00')])
+        self.assertEqual(sorted(os.listdir(self.config.host_collation_dir('h'))), ['index', 'lock', index[0][0]])
+        self.assertNotIn(consumed[0], os.listdir(self.config.host_collation_dir('h')))
+        self.assertEqual(store.consolidation_sources(['h']), { '/home/v': { 'h': ['20190102-00:00:00 h 1:00\n'] } })
+
+    def test_merge(self):
+        self.append([('/home/u', '20190101-00:00:00', 'h', '1:00'),
+                     ('/home/v', '20190102-00:00:00', 'h', '1:00')])
+        self.append([('/home/u', '20190103-00:00:00', 'h', '2:00')])
+        Merger(self.args).merge()
+        with open(os.path.join(self.consolidation_dir, 'home', 'u')) as f:
+            self.assertEqual(f.read(), '20190101-00:00:00 h 1:00\n20190103-00:00:00 h 2:00\n')
+        with open(os.path.join(self.consolidation_dir, 'home', 'v')) as f:
+            self.assertEqual(f.read(), '20190102-00:00:00 h 1:00\n')
+        self.assertEqual(LogStore(self.config, False).read_index('h'), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+from .LogWatcher import LogWatcher
+
+class TestLogWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def wait_for(self, watcher, action, timeout=10):
+        """Return how long the watcher waited, when action is done shortly after waiting starts."""
+        timer = threading.Timer(0.1, action)
+        timer.start()
+        start = time.monotonic()
+        watcher.wait(timeout)
+        timer.join()
+        return time.monotonic() - start
+
+    def write_log(self):
+        with open(os.path.join(self._tmpdir.name, 'automount'), 'a') as f:
+            f.write('line\n')
+
+    def test_change(self):
+        watcher = LogWatcher(self._tmpdir.name, poll_interval=0.5)
+        try:
+            self.assertLess(self.wait_for(watcher, self.write_log), 5 if watcher.inotify else 1)
+            # nothing more to wait for
+            self.assertLess(self.wait_for(watcher, lambda: None, timeout=0.3), 1)
+        finally:
+            watcher.close()
+
+    def test_signal(self):
+        handler = signal.signal(signal.SIGUSR1, lambda signum, frame: None)
+        watcher = LogWatcher(self._tmpdir.name, poll_interval=60)
+        try:
+            self.assertLess(self.wait_for(watcher, lambda: os.kill(os.getpid(), signal.SIGUSR1)), 5)
+        finally:
+            watcher.close()
+            signal.signal(signal.SIGUSR1, handler)
+
+if __name__ == '__main__':
+    unittest.main()
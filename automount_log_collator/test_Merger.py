@@ -0,0 +1,88 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import unittest
+
+from .Merger import Merger
+from .UsageStats import UsageStats
+from .testing import CollationTestCase
+
+class TestMerger(CollationTestCase):
+
+    def write_history(self, host, lines, user='user'):
+        history_path = os.path.join(self.collation_dir, host, '_home', '_%s' % user, 'history')
+        os.makedirs(os.path.dirname(history_path), exist_ok=True)
+        with open(history_path, 'w') as f:
+            f.writelines(lines)
+
+    def write_consolidated(self, lines):
+        outpath = os.path.join(self.consolidation_dir, 'home', 'user')
+        os.makedirs(os.path.dirname(outpath), exist_ok=True)
+        with open(outpath, 'w') as f:
+            f.writelines(lines)
+        return outpath
+
+    def merge(self, user='user'):
+        Merger(self.args).merge()
+        return self.read_consolidated(user)
+
+    def read_consolidated(self, user='user'):
+        with open(os.path.join(self.consolidation_dir, 'home', user)) as f:
+            return f.readlines()
+
+    def test_append(self):
+        outpath = self.write_consolidated(['20190101-00:00:00 a 1:00\n', '20190102-00:00:00 a 1:00\n'])
+        inode = os.stat(outpath).st_ino
+        self.write_history('a', ['20190103-00:00:00 a 1:00\n', '20190105-00:00:00 a 1:00\n'])
+        self.write_history('b', ['20190104-00:00:00 b 1:00\n'])
+        self.assertEqual(self.merge(), ['20190101-00:00:00 a 1:00\n', '20190102-00:00:00 a 1:00\n',
+                                        '20190103-00:00:00 a 1:00\n', '20190104-00:00:00 b 1:00\n',
+                                        '20190105-00:00:00 a 1:00\n'])
+        # appended in place, not replaced
+        self.assertEqual(os.stat(outpath).st_ino, inode)
+
+    def test_interleaved(self):
+        self.write_consolidated(['20190101-00:00:00 a 1:00\n', '20190103-00:00:00 a 1:00\n'])
+        self.write_history('b', ['20190102-00:00:00 b 1:00\n', '20190104-00:00:00 b 1:00\n'])
+        self.assertEqual(self.merge(), ['20190101-00:00:00 a 1:00\n', '20190102-00:00:00 b 1:00\n',
+                                        '20190103-00:00:00 a 1:00\n', '20190104-00:00:00 b 1:00\n'])
+
+    def test_usage(self):
+        self.write_consolidated(['20190101-00:00:00 a 1:00\n', '20190103-00:00:00 a 1:00\n'])
+        stats_path = os.path.join(self.consolidation_dir, '.stats')
+        UsageStats().save(stats_path)
+        self.write_history('b', ['20190102-00:00:00 b 1:00\n', '20190104-00:00:00 b 2:00\n'])
+        self.merge()
+        # only the newly merged lines are folded in
+        usage = UsageStats()
+        self.assertTrue(usage.load(stats_path))
+        self.assertEqual(usage.totals['201901'], { 'host': { 'b': [2, 10800] }, 'path': { '/home/user': [2, 10800] } })
+
+    def test_parallel(self):
+        self.args.jobs = 2
+        for i in range(4):
+            self.write_history('a', ['20190101-00:00:00 a 1:00\n', '20190103-00:00:00 a 1:00\n'], user='user%d' % i)
+            self.write_history('b', ['20190102-00:00:00 b 1:00\n'], user='user%d' % i)
+        Merger(self.args).merge()
+        for i in range(4):
+            self.assertEqual(self.read_consolidated('user%d' % i),
+                             ['20190101-00:00:00 a 1:00\n', '20190102-00:00:00 b 1:00\n', '20190103-00:00:00 a 1:00\n'])
+        # history files are removed once consolidated
+        self.assertFalse(os.path.exists(os.path.join(self.collation_dir, 'a', '_home', '_user0', 'history')))
+
+if __name__ == '__main__':
+    unittest.main()
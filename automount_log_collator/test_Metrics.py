@@ -0,0 +1,72 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os.path
+import tempfile
+import unittest
+
+from .Collator import Collator
+from .Metrics import Metrics
+from .testing import CollationTestCase
+from .util import timestamp_from_str
+
+class TestMetrics(CollationTestCase):
+
+    def metrics(self):
+        metrics = Metrics('collate')
+        with metrics.phase('load'):
+            pass
+        with metrics.phase('scan', '/var/log/automount'):
+            metrics.count('lines_read', 100)
+            metrics.count('events_matched', 10)
+        return metrics
+
+    def test_json(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'metrics.json')
+            self.metrics().save(path)
+            with open(path) as f:
+                metrics = json.load(f)
+        self.assertEqual(metrics['command'], 'collate')
+        self.assertEqual([ (phase['phase'], phase.get('logfile')) for phase in metrics['phases'] ],
+                         [ ('load', None), ('scan', '/var/log/automount') ])
+        self.assertEqual(metrics['counters']['lines_read'], 100)
+        self.assertEqual(metrics['counters']['history_appends'], 0)
+
+    def test_prometheus(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'metrics.prom')
+            self.metrics().save(path)
+            with open(path) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(os.listdir(tmpdir), ['metrics.prom'])
+        samples = dict(line.rsplit(' ', 1) for line in lines if not line.startswith('#'))
+        self.assertIn('automount_log_collator_phase_seconds{command="collate",logfile="/var/log/automount",phase="scan"}', samples)
+        self.assertEqual(samples['automount_log_collator_events_matched{command="collate"}'], '10')
+
+    def test_active_files_rewritten(self):
+        metrics = Metrics('collate')
+        collator = Collator(self.config, False, metrics, 'h')
+        collator.mount(timestamp_from_str('20190101-00:00:00'), '/home/a')
+        collator.mount(timestamp_from_str('20190101-00:01:00'), '/home/b')
+        collator.finalize()
+        self.assertEqual(metrics.counters['files_rewritten'], 2)
+        collator.unmount(timestamp_from_str('20190101-01:00:00'), '/home/a')
+        collator.finalize()
+        self.assertEqual(metrics.counters['files_rewritten'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,271 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import contextlib
+import gzip
+import io
+import locale
+import os
+import os.path
+import pendulum
+import queue
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from .Scanner import LogfileEvents, Scanner, logfile_chunk_events, logfile_chunks
+from .testing import CollationTestCase
+from .util import bare_hostname, escape_path, timestamp_str
+
+class TestScanner(CollationTestCase):
+
+    def scan(self, jobs=1):
+        Scanner(argparse.Namespace(config=self.config_path, verbose=False, jobs=jobs, metrics=None, args=[])).scan()
+
+    @staticmethod
+    def line(day, hour, action, path):
+        return 'Jan %2d %02d:00:00 h automount[1]: %s %s\n' % (day, hour, action, path)
+
+    def write_live(self, lines, mode='w'):
+        logpath = os.path.join(self.log_dir, 'automount')
+        with open(logpath, mode) as f:
+            f.writelines(lines)
+        # later than the lines, as if just written
+        t = pendulum.datetime(2019, 1, 10, tz=pendulum.now().timezone).int_timestamp
+        os.utime(logpath, (t, t))
+        return logpath
+
+    def mounts_dir(self, path):
+        return os.path.join(self.collation_dir, bare_hostname(), escape_path(path))
+
+    def history(self, path):
+        try:
+            with open(os.path.join(self.mounts_dir(path), 'history')) as f:
+                return f.read()
+        except FileNotFoundError:
+            return ''
+
+    def history_line(self, timestamp_s, duration):
+        return '%s %s %s\n' % (timestamp_s, bare_hostname(), duration)
+
+    def checkpoint(self):
+        with open(os.path.join(self.collation_dir, '.%s.collated' % bare_hostname())) as f:
+            return f.read().splitlines()
+
+    def scan_first(self):
+        lines = [ self.line(1, 0, 'mounted', '/home/a'), self.line(1, 1, 'expired', '/home/a') ]
+        # partial line still being written
+        logpath = self.write_live(lines + [ self.line(1, 2, 'mounted', '/home/b').rstrip('\n') ])
+        self.scan()
+        st = os.stat(logpath)
+        self.assertEqual(self.checkpoint(), [ '20190101-01:00:00',
+                                              'logfile %d %d %d' % (st.st_ino, st.st_size, len(''.join(lines))) ])
+        self.assertEqual(self.history('/home/a'), self.history_line('20190101-01:00:00', '1:00'))
+        return logpath
+
+    def test_resume(self):
+        logpath = self.scan_first()
+        # lines before the checkpoint aren't read again, even if they have changed
+        with open(logpath, 'r+') as f:
+            f.write(self.line(1, 5, 'mounted', '/home/z'))
+        logpath = self.write_live([ '\n', self.line(1, 3, 'expired', '/home/b') ], 'a')
+        self.scan()
+        self.assertEqual(self.history('/home/a'), self.history_line('20190101-01:00:00', '1:00'))
+        self.assertEqual(self.history('/home/b'), self.history_line('20190101-03:00:00', '1:00'))
+        self.assertFalse(os.path.exists(self.mounts_dir('/home/z')))
+        st = os.stat(logpath)
+        self.assertEqual(self.checkpoint(), [ '20190101-03:00:00', 'logfile %d %d %d' % (st.st_ino, st.st_size, st.st_size) ])
+
+    def test_truncated(self):
+        self.scan_first()
+        self.write_live([ self.line(2, 0, 'mounted', '/home/c'), self.line(2, 1, 'expired', '/home/c') ])
+        self.scan()
+        self.assertEqual(self.history('/home/c'), self.history_line('20190102-01:00:00', '1:00'))
+
+    def test_rotated(self):
+        logpath = self.scan_first()
+        os.rename(logpath, '%s.1' % logpath)
+        # longer than the checkpoint offset in the rotated logfile
+        self.write_live([ self.line(2, 0, 'mounted', '/home/d'), self.line(2, 1, 'expired', '/home/d') ] +
+                        [ 'Jan  2 02:00:00 h kernel: something else\n' ] * 3)
+        self.scan()
+        self.assertEqual(self.history('/home/d'), self.history_line('20190102-01:00:00', '1:00'))
+
+    def test_compressed(self):
+        # each mount expires in the next rotated logfile, so they must be collated in order
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs), tempfile.TemporaryDirectory() as tmpdir:
+                self.make_config(tmpdir)
+                for day in range(1, 7):
+                    with gzip.open(os.path.join(self.log_dir, 'automount-201901%02d.gz' % (day + 1)), 'wt') as f:
+                        if day > 1:
+                            f.write(self.line(day, 1, 'expired', '/home/a'))
+                        if day < 6:
+                            f.write(self.line(day, 23, 'mounted', '/home/a'))
+                self.scan(jobs)
+                self.assertEqual(self.history('/home/a'),
+                                 ''.join(self.history_line('201901%02d-01:00:00' % day, '2:00') for day in range(2, 7)))
+                self.assertEqual(self.checkpoint(), ['20190106-01:00:00'])
+
+    def events(self, data):
+        events = LogfileEvents(io.BytesIO(data), 'automount', 2019, 1)
+        return events, [ (event.action, timestamp_str(event.t), event.path) for event in events ]
+
+    def test_bad_encoding(self):
+        try:
+            b'\xff'.decode(locale.getpreferredencoding(False))
+            self.skipTest('the locale encoding decodes any bytes')
+        except UnicodeDecodeError:
+            pass
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            events, result = self.events(b'Jan  1 00:00:00 h automount[1]: mounted /home/a\n'
+                                         b'Jan  1 00:10:00 h automount[1]: mounted /home/\xff\n'
+                                         b'Jan  1 00:20:00 h kernel: \xff not a mount\n'
+                                         b'Jan  1 01:00:00 h automount[1]: expired /home/a\n')
+        self.assertEqual(result, [ ('mounted', '20190101-00:00:00', '/home/a'), ('expired', '20190101-01:00:00', '/home/a') ])
+        # only the line which might be an event is decoded, and the rest are still counted
+        self.assertEqual(err.getvalue(), 'warning: ignoring badly encoded line at automount:2\n')
+        self.assertEqual(events.lineno, 4)
+
+    def test_crlf(self):
+        data = b'Jan  1 00:00:00 h automount[1]: mounted /home/a\r\nJan  1 01:00:00 h automount[1]: expired /home/a\r\n'
+        events, result = self.events(data)
+        self.assertEqual(result, [ ('mounted', '20190101-00:00:00', '/home/a'), ('expired', '20190101-01:00:00', '/home/a') ])
+        self.assertEqual(events.offset, len(data))
+
+class TestFollow(CollationTestCase):
+
+    months = [ 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec' ]
+
+    def setUp(self):
+        super().setUp()
+        # the follower takes the year and month of the live logfile from now
+        now = time.localtime()
+        self.month = self.months[now.tm_mon - 1]
+        self.date = '%04d%02d01' % (now.tm_year, now.tm_mon)
+        self.logpath = os.path.join(self.log_dir, 'automount')
+
+    def line(self, hour, action, path):
+        return '%s  1 %02d:00:00 h automount[1]: %s %s\n' % (self.month, hour, action, path)
+
+    def append(self, logpath, lines):
+        with open(logpath, 'a') as f:
+            f.writelines(lines)
+
+    def follow(self):
+        """Start collate --follow, with its verbose output read into self.output."""
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.proc = subprocess.Popen([ sys.executable, '-u', '-m', 'automount_log_collator', '--verbose', '--config', self.config_path,
+                                       'collate', '--follow', '--checkpoint-interval', '3600', '--poll-interval', '0.05' ],
+                                     cwd=package_dir, stdout=subprocess.PIPE, universal_newlines=True)
+        self.output = queue.Queue()
+        def read():
+            for line in self.proc.stdout:
+                self.output.put(line)
+        self.reader = threading.Thread(target=read, daemon=True)
+        self.reader.start()
+
+    def wait_for(self, prefix):
+        """Wait until the follower writes a line starting with prefix."""
+        while not self.output.get(timeout=10).startswith(prefix):
+            pass
+
+    def read_collation_file(self, filename):
+        with open(os.path.join(self.collation_dir, filename)) as f:
+            return f.read()
+
+    def history(self, path):
+        with open(os.path.join(self.collation_dir, bare_hostname(), escape_path(path), 'history')) as f:
+            return f.read()
+
+    def test_follow(self):
+        self.append(self.logpath, [ self.line(0, 'mounted', '/home/a'), self.line(1, 'expired', '/home/a'),
+                                    self.line(2, 'mounted', '/home/b') ])
+        self.follow()
+        try:
+            self.wait_for('mount /home/b at ')
+            self.append(self.logpath, [ self.line(3, 'expired', '/home/b'), self.line(4, 'mounted', '/home/c') ])
+            self.wait_for('mount /home/c at ')
+            # the logger finishes the rotated logfile without a final newline
+            os.rename(self.logpath, '%s.1' % self.logpath)
+            self.append('%s.1' % self.logpath, [ self.line(5, 'expired', '/home/c').rstrip('\n') ])
+            live_lines = [ self.line(6, 'mounted', '/home/d'), self.line(7, 'expired', '/home/d'),
+                           self.line(8, 'mounted', '/home/e') ]
+            # partial line still being written
+            self.append(self.logpath, live_lines + [ self.line(9, 'expired', '/home/e').rstrip('\n') ])
+            self.wait_for('mount /home/e at ')
+        finally:
+            self.proc.send_signal(signal.SIGTERM)
+            self.proc.wait(timeout=10)
+            self.reader.join()
+        self.assertEqual(self.proc.returncode, 0)
+        # everything collated since the first checkpoint was saved on termination
+        for path, hour in [ ('/home/a', 1), ('/home/b', 3), ('/home/c', 5), ('/home/d', 7) ]:
+            self.assertEqual(self.history(path), '%s-%02d:00:00 %s 1:00\n' % (self.date, hour, bare_hostname()))
+        self.assertEqual(self.read_collation_file('.%s.active' % bare_hostname()), '%s-08:00:00 /home/e\n' % self.date)
+        st = os.stat(self.logpath)
+        self.assertEqual(self.read_collation_file('.%s.collated' % bare_hostname()).splitlines(),
+                         [ '%s-08:00:00' % self.date, 'logfile %d %d %d' % (st.st_ino, st.st_size, len(''.join(live_lines))) ])
+
+class TestLogfileChunks(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.logpath = os.path.join(self._tmpdir.name, 'automount')
+        lines = []
+        for i in range(200):
+            month, day = ('Dec', 31) if i < 100 else ('Jan', 1)
+            action = 'mounted' if i % 2 == 0 else 'expired'
+            lines.append('%s %2d %02d:%02d:00 h automount[1]: %s /home/u%d\n' % (month, day, i // 60 % 24, i % 60, action, i % 7))
+            lines.append('%s %2d %02d:%02d:00 h kernel: something else\n' % (month, day, i // 60 % 24, i % 60))
+        with open(self.logpath, 'w') as f:
+            f.writelines(lines)
+            # partial line still being written
+            f.write('Jan  1 04:00:00 h automount[1]: mounted /home/x')
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_chunks(self):
+        size = os.path.getsize(self.logpath)
+        with open(self.logpath, 'rb') as logf:
+            whole = LogfileEvents(logf, self.logpath, 2020, 1, complete_lines_only=True)
+            expected = list(whole)
+            offsets = logfile_chunks(logf, 0, size, 1000)
+            self.assertEqual(offsets[0], 0)
+            self.assertEqual(offsets[-1], size)
+            for offset in offsets[1:-1]:
+                logf.seek(offset - 1)
+                self.assertEqual(logf.read(1), b'\n')
+        inode = os.stat(self.logpath).st_ino
+        events = []
+        lines_read = 0
+        for start, stop in zip(offsets, offsets[1:]):
+            chunk_events, chunk_lines_read, offset = logfile_chunk_events(self.logpath, inode, 2020, 1, start, stop, None)
+            events.extend(chunk_events)
+            lines_read += chunk_lines_read
+        self.assertEqual(len(expected), 200)
+        self.assertEqual(events, expected)
+        self.assertEqual(lines_read, whole.lineno)
+        self.assertEqual(offset, whole.offset)
+        self.assertLess(offset, size)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import sqlite3
+import unittest
+
+from .Merger import Merger
+from .SqliteStore import SqliteStore
+from .testing import CollationTestCase
+from .util import timestamp_from_str
+
+class TestSqliteStore(CollationTestCase):
+
+    collation_store = 'sqlite'
+
+    def rows(self, table):
+        db = sqlite3.connect(self.config.collation_db)
+        try:
+            return db.execute('SELECT path, host, t1, duration FROM %s ORDER BY rowid' % table).fetchall()
+        finally:
+            db.close()
+
+    def test_consolidate(self):
+        t = timestamp_from_str('20190101-00:00:00')
+        store = SqliteStore(self.config, False, batchsize=2)
+        store.append('/home/u', t + 10, 'a', '1:00')
+        store.append('/home/v', t + 20, 'a', '0:10')
+        store.append('/home/u', t + 30, 'a', 'unknown')
+        self.assertEqual(len(self.rows('collated')), 2)
+        store.close()
+        self.assertEqual(self.rows('collated'), [('/home/u', 'a', t + 10, '1:00'),
+                                                 ('/home/v', 'a', t + 20, '0:10'),
+                                                 ('/home/u', 'a', t + 30, 'unknown')])
+        os.makedirs(self.collation_dir, exist_ok=True)
+        Merger(self.args).merge()
+        self.assertEqual(self.rows('collated'), [])
+        self.assertEqual(len(self.rows('consolidated')), 3)
+
+    def test_import(self):
+        store = SqliteStore(self.config, False)
+        self.assertFalse(store.has_consolidated())
+        store.import_consolidated('/home/u', ['20190101-00:00:00 a 1:00\n', '\n', '20190102-00:00:00 b 2d-1:00\n'])
+        store.import_history('c', [('/home/v', ['20190103-00:00:00 c 0:01\n'])])
+        self.assertTrue(store.has_consolidated())
+        store.close()
+        self.assertEqual(self.rows('consolidated'), [('/home/u', 'a', timestamp_from_str('20190101-00:00:00'), '1:00'),
+                                                     ('/home/u', 'b', timestamp_from_str('20190102-00:00:00'), '2d-1:00')])
+        self.assertEqual(self.rows('collated'), [('/home/v', 'c', timestamp_from_str('20190103-00:00:00'), '0:01')])
+
+if __name__ == '__main__':
+    unittest.main()
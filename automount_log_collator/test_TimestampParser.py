@@ -0,0 +1,84 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import pendulum
+import time
+import unittest
+
+from .TimestampParser import TimestampParser
+
+class TestTimestampParser(unittest.TestCase):
+
+    def setUp(self):
+        # parsing is in the local timezone, so make that one with daylight saving
+        self.tz = pendulum.timezone('Pacific/Auckland')
+        self._saved_tz = os.environ.get('TZ')
+        os.environ['TZ'] = self.tz.name
+        time.tzset()
+        pendulum.set_local_timezone(self.tz)
+
+    def tearDown(self):
+        if self._saved_tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self._saved_tz
+        time.tzset()
+        pendulum.set_local_timezone()
+
+    def reference(self, logfile_dt, timestamp_s):
+        """The original per-line parse, which the TimestampParser must agree with."""
+        timestamp_year = logfile_dt.year - 1 if timestamp_s.startswith('Dec') and logfile_dt.month == 1 else logfile_dt.year
+        return pendulum.parse('%d %s' % (timestamp_year, timestamp_s), tz=self.tz, strict=False).int_timestamp
+
+    def assertParsesAsReference(self, logfile_dt, timestamps):
+        parser = TimestampParser(logfile_dt.year, logfile_dt.month)
+        for timestamp_s in timestamps:
+            self.assertEqual(parser.parse(timestamp_s), self.reference(logfile_dt, timestamp_s), timestamp_s)
+
+    def test_parse(self):
+        logfile_dt = pendulum.datetime(2019, 10, 17, tz=self.tz)
+        self.assertParsesAsReference(logfile_dt, [
+            'Oct 17 12:34:56',
+            'Oct 17 12:34:56',
+            'Oct  7 01:02:03',
+            'Oct 7 1:2:3',
+            'Feb 28 23:59:59',
+            'Sep 30 00:00:00',
+            'Sept 30 00:00:00',
+            'october 1 10:00:00',
+        ])
+
+    def test_year_rollover(self):
+        self.assertParsesAsReference(pendulum.datetime(2020, 1, 2, tz=self.tz), [
+            'Dec 31 23:59:59',
+            'Jan  1 00:00:00',
+        ])
+        self.assertParsesAsReference(pendulum.datetime(2019, 12, 31, tz=self.tz), [
+            'Dec 31 23:59:59',
+        ])
+
+    def test_dst_transitions(self):
+        # NZ daylight saving started 2019-09-29 02:00, and ended 2019-04-07 03:00
+        self.assertParsesAsReference(pendulum.datetime(2019, 10, 1, tz=self.tz), [
+            'Sep 29 01:59:59',
+            'Sep 29 02:30:00',
+            'Sep 29 03:00:00',
+            'Apr  7 02:30:00',
+            'Apr  7 03:30:00',
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os.path
+import tempfile
+import unittest
+
+from .UsageStats import UsageStats
+
+class ShortUsageStats(UsageStats):
+    open_days = 1
+
+class TestUsageStats(unittest.TestCase):
+
+    lines = [ ('/home/a', '20190101-10:00:00 h1 2:00\n'),
+              ('/home/b', '20190101-11:00:00 h1 1:30\n'),
+              ('/home/a', '20190101-12:00:00 h2 1:00\n'),
+              ('/home/b', '20190102-01:00:00 h2 3:00\n'),
+              ('/home/a', '20190201-00:00:00 h1 unknown\n') ]
+
+    def usage(self, lines, cls=UsageStats):
+        usage = cls()
+        for path, line in lines:
+            usage.add(line, path)
+        return usage
+
+    def test_totals(self):
+        usage = self.usage(self.lines)
+        self.assertEqual(usage.totals['20190101']['host'], { 'h1': [2, 12600], 'h2': [1, 3600] })
+        self.assertEqual(usage.totals['201901']['path'], { '/home/a': [2, 10800], '/home/b': [2, 16200] })
+        # mounts of unknown duration are counted, but have none
+        self.assertEqual(usage.totals['201902']['host'], { 'h1': [1, 0] })
+
+    def test_peaks(self):
+        peaks = self.usage(self.lines).peaks()
+        # one mount on h2 starts as one on h1 ends
+        self.assertEqual(peaks['20190101'], { 'h1': 2, 'h2': 1, '*': 2 })
+        # the mount from the day before is still active
+        self.assertEqual(peaks['20190102'], { 'h1': 0, 'h2': 1, '*': 1 })
+        self.assertEqual(peaks['201901'], { 'h1': 2, 'h2': 1, '*': 2 })
+
+    def test_update(self):
+        usage = self.usage(self.lines[:2])
+        usage.update(self.usage(self.lines[2:]))
+        expected = self.usage(self.lines)
+        self.assertEqual(usage.totals, expected.totals)
+        self.assertEqual(usage.deltas, expected.deltas)
+
+    def test_cache(self):
+        usage = self.usage(self.lines)
+        usage.rowid = 5
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_path = os.path.join(tmpdir, 'consolidated', '.stats')
+            self.assertFalse(UsageStats().load(cache_path))
+            usage.save(cache_path)
+            loaded = UsageStats()
+            self.assertTrue(loaded.load(cache_path))
+        self.assertEqual(loaded.totals, usage.totals)
+        self.assertEqual(loaded.peaks(), usage.peaks())
+        self.assertEqual(loaded.rowid, 5)
+
+    def test_freeze(self):
+        usage = self.usage(self.lines, ShortUsageStats)
+        peaks = usage.peaks()
+        usage.freeze()
+        # only days within a day of the latest still have deltas
+        self.assertEqual(usage.frozen_until, '20190131')
+        self.assertEqual(usage.deltas, {})
+        self.assertEqual(usage.frozen_levels, { 'h1': 0, 'h2': 0 })
+        self.assertEqual(usage.peaks(), peaks)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_path = os.path.join(tmpdir, '.stats')
+            usage.save(cache_path)
+            usage = ShortUsageStats()
+            self.assertTrue(usage.load(cache_path))
+        self.assertEqual(usage.peaks(), peaks)
+
+        # a late mount from a frozen day is still active on the open ones
+        usage.add('20190201-12:00:00 h2 1d-0:00\n', '/home/c')
+        self.assertEqual(usage.frozen_levels, { 'h1': 0, 'h2': 1 })
+        self.assertEqual(usage.totals['20190201']['host']['h2'], [1, 86400])
+        peaks = usage.peaks()
+        self.assertEqual(peaks['20190101'], { 'h1': 2, 'h2': 1, '*': 2 })
+        self.assertEqual(peaks['20190201'], { 'h1': 0, 'h2': 1, '*': 1 })
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,9 +13,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import tempfile
 import unittest
 
-from .util import path_splitall, escape_path, unescape_path
+from .util import ( path_splitall, escape_path, unescape_path, unescape_mountinfo, read_mount_points,
+                    duration_str, duration_seconds, timestamp_str, timestamp_from_str, read_last_line, prune_empty_dirs )
 
 class TestUtil(unittest.TestCase):
 
@@ -34,5 +37,61 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(unescape_path('/_a/_b/_c'), '/a/b/c')
         self.assertEqual(unescape_path('_a/_b/_c'), 'a/b/c')
 
+    def test_unescape_mountinfo(self):
+        self.assertEqual(unescape_mountinfo('/a/b'), '/a/b')
+        self.assertEqual(unescape_mountinfo('/a\\040b\\011c\\134d'), '/a b\tc\\d')
+
+    def test_read_mount_points(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mountinfo_path = os.path.join(tmpdir, 'mountinfo')
+            with open(mountinfo_path, 'w') as f:
+                f.write('22 1 0:21 / / rw,relatime shared:1 - ext4 /dev/sda1 rw\n')
+                f.write('97 22 0:47 / /home/a\\040b rw,relatime shared:52 - nfs4 server:/home/a rw\n')
+            self.assertEqual(read_mount_points(mountinfo_path), set(['/', '/home/a b']))
+
+    def test_read_last_line(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'lines')
+            with open(path, 'w') as f:
+                for i in range(20):
+                    f.write('line %d %s\n' % (i, 'x' * 1000))
+            self.assertEqual(read_last_line(path), 'line 19 %s\n' % ('x' * 1000))
+            open(path, 'w').close()
+            self.assertEqual(read_last_line(path), '')
+
+    def test_prune_empty_dirs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            rootdir = os.path.join(tmpdir, 'root')
+            for d in ['a/b/c', 'a/b/d', 'a/e', 'f/g']:
+                os.makedirs(os.path.join(rootdir, d))
+            open(os.path.join(rootdir, 'a', 'e', 'history'), 'w').close()
+            self.assertEqual(prune_empty_dirs([ os.path.join(rootdir, d) for d in ['a/b/c', 'a/b/d', 'a/e'] ], rootdir), 3)
+            self.assertEqual(sorted(os.listdir(rootdir)), ['a', 'f'])
+            self.assertEqual(os.listdir(os.path.join(rootdir, 'a')), ['e'])
+            self.assertEqual(prune_empty_dirs([os.path.join(rootdir, 'f', 'g')], rootdir), 2)
+            self.assertEqual(os.listdir(rootdir), ['a'])
+            os.remove(os.path.join(rootdir, 'a', 'e', 'history'))
+            self.assertEqual(prune_empty_dirs([os.path.join(rootdir, 'a', 'e')], rootdir), 3)
+            self.assertEqual(os.listdir(tmpdir), [])
+
+    def test_duration_str(self):
+        self.assertEqual(duration_str(1000, 1000), '0:00')
+        self.assertEqual(duration_str(1000, 1000 + 3 * 3600 + 7 * 60 + 59), '3:07')
+        self.assertEqual(duration_str(1000, 1000 + 2 * 86400 + 3600), '2d-1:00')
+        self.assertEqual(duration_str(1000 + 23 * 3600 + 30 * 60, 1000), '-23:-30')
+
+    def test_duration_seconds(self):
+        for seconds in [0, 3 * 3600 + 7 * 60, 2 * 86400 + 3600, -(23 * 3600 + 30 * 60)]:
+            self.assertEqual(duration_seconds(duration_str(0, seconds)), seconds)
+        self.assertIsNone(duration_seconds('unknown'))
+
+    def test_timestamp_str(self):
+        for s in ['20190101-00:00:00', '20191017-12:34:56', '20201231-23:59:59']:
+            t = timestamp_from_str(s)
+            self.assertIsInstance(t, int)
+            self.assertEqual(timestamp_str(t), s)
+        self.assertEqual(timestamp_from_str('20191017-12:34:57\n') - timestamp_from_str('20191017-12:34:56'), 1)
+        self.assertRaises(ValueError, timestamp_from_str, '2019-10-17 12:34:56')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,49 @@
+# Copyright (c) 2019 Simon Guest
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import os
+import os.path
+import tempfile
+import unittest
+
+from .Config import Config
+
+class CollationTestCase(unittest.TestCase):
+    """A test case with log, collation and consolidation directories in a temporary
+    directory, and a configuration file for them using collation_store."""
+
+    collation_store = 'tree'
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.make_config(self._tmpdir.name)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def make_config(self, tmpdir):
+        """Configure collation in tmpdir, for tests which need more than one."""
+        self.collation_dir = os.path.join(tmpdir, 'collated')
+        self.consolidation_dir = os.path.join(tmpdir, 'consolidated')
+        self.log_dir = os.path.join(tmpdir, 'log')
+        os.makedirs(self.collation_dir)
+        os.makedirs(self.log_dir)
+        self.config_path = os.path.join(tmpdir, 'config.toml')
+        with open(self.config_path, 'w') as f:
+            f.write('log-dir = "%s"\ncollation-dir = "%s"\nconsolidation-dir = "%s"\nmount-check = "none"\ncollation-store = "%s"\n' %
+                    (self.log_dir, self.collation_dir, self.consolidation_dir, self.collation_store))
+        self.args = argparse.Namespace(config=self.config_path, verbose=False, jobs=1, metrics=None)
+        self.config = Config(self.args)
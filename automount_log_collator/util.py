@@ -13,9 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import calendar
+import locale
 import os
 import pendulum
+import re
 import sys
+import threading
+import time
 
 def bare_hostname():
     """Hostname without domain."""
@@ -33,39 +38,132 @@ def append_and_set_timestamp(inpath, outpath):
     t = os.stat(inpath).st_mtime
     os.utime(outpath, (t, t))
 
+def read_last_line(path, blocksize=4096):
+    """Return the last line of a text file, or '' if it is empty, reading back only as
+    far as the start of that line, so large files are cheap."""
+    with open(path, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        tail = b''
+        while pos > 0:
+            n = min(blocksize, pos)
+            pos -= n
+            f.seek(pos)
+            tail = f.read(n) + tail
+            # the newline ending the last line doesn't count
+            start = tail.rfind(b'\n', 0, len(tail) - 1)
+            if start >= 0:
+                tail = tail[start + 1:]
+                break
+    return tail.decode(locale.getpreferredencoding(False))
+
 def merge_lists(l1, l2):
     return list(set(l1) | set(l2))
 
 def duration_str(t1, t2):
-    """String difference between pendulum datetimes."""
+    """String difference between integer timestamps, as elapsed time."""
     delta = t2 - t1
-    d = delta.days
-    h = delta.hours
-    m = delta.minutes
+    sign = -1 if delta < 0 else 1
+    delta = abs(delta)
+    d = sign * (delta // 86400)
+    h = sign * (delta % 86400 // 3600)
+    m = sign * (delta % 3600 // 60)
     if d > 0:
         result = '%dd-%d:%02d' % (d, h, m)
     else:
         result = '%d:%02d' % (h, m)
     return result
 
+def duration_seconds(s):
+    """Return the seconds in a duration as formatted by duration_str, or None if it isn't one, such as unknown."""
+    try:
+        days, _, hm = s.rpartition('d-')
+        h, m = hm.split(':')
+        return (int(days) if days else 0) * 86400 + int(h) * 3600 + int(m) * 60
+    except ValueError:
+        return None
+
 def timestamp_str(t0):
-    return t0.strftime('%Y%m%d-%H:%M:%S')
+    """Format integer timestamp in local time, which is how timestamps are stored in files."""
+    return time.strftime('%Y%m%d-%H:%M:%S', time.localtime(t0))
+
+_day_offsets = {}   # (timezone, year, month, day) -> UTC offset, or None if it changes during the day
+
+def _day_offset(tz, year, month, day):
+    try:
+        return _day_offsets[(tz.name, year, month, day)]
+    except KeyError:
+        start = pendulum.datetime(year, month, day, tz=tz)
+        end = pendulum.datetime(year, month, day, 23, 59, 59, tz=tz)
+        offset = start.offset if start.offset == end.offset else None
+        _day_offsets[(tz.name, year, month, day)] = offset
+        return offset
+
+def local_timestamp(year, month, day, hour=0, minute=0, second=0):
+    """Return the integer timestamp for a local time.
+
+    This is the same as the int_timestamp of the pendulum datetime in the local
+    timezone, but a datetime is only constructed on days when the UTC offset
+    changes, and otherwise the offset for the day is cached."""
+    if not (0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 60):
+        raise ValueError('invalid time %02d:%02d:%02d' % (hour, minute, second))
+    tz = pendulum.local_timezone()
+    offset = _day_offset(tz, year, month, day)
+    if offset is None:
+        return pendulum.datetime(year, month, day, hour, minute, second, tz=tz).int_timestamp
+    return calendar.timegm((year, month, day, hour, minute, second)) - offset
 
 def timestamp_from_str(s):
-    return pendulum.from_format(s, 'YYYYMMDD-HH:mm:ss', tz=pendulum.now().timezone)
+    """Parse a local time formatted as YYYYMMDD-HH:MM:SS, as an integer timestamp."""
+    s = s.strip()
+    if len(s) != 17 or s[8] != '-' or s[11] != ':' or s[14] != ':':
+        raise ValueError('invalid timestamp %s' % s)
+    return local_timestamp(int(s[0:4]), int(s[4:6]), int(s[6:8]), int(s[9:11]), int(s[12:14]), int(s[15:17]))
+
+def read_manifest(manifest_path):
+    """Return the active mounts and their timestamps from a manifest."""
+    mounts = {}
+    with open(manifest_path) as f:
+        for line in f:
+            timestamp_s, path = line.split()
+            mounts[path] = timestamp_from_str(timestamp_s)
+    return mounts
+
+def write_manifest(manifest_path, mounts):
+    """Atomically replace the manifest of active mounts."""
+    manifest_path_new = '%s.new' % manifest_path
+    with open(manifest_path_new, 'w') as f:
+        for path, t0 in sorted(mounts.items()):
+            f.write('%s %s\n' % (timestamp_str(t0), path))
+    os.rename(manifest_path_new, manifest_path)
 
 def rmdir_if_empty(dirpath):
+    """Remove dirpath if it is empty, returning whether it was removed."""
     try:
         os.rmdir(dirpath)
+        return True
     except OSError:
         # non-empty, didn't want to delete it anyway
-        pass
+        return False
 
-def purge_empty_dirs(rootdir):
-    for root, dirs, files in os.walk(rootdir, topdown=False):
-        for dirname in dirs:
-            rmdir_if_empty(os.path.join(root, dirname))
-    rmdir_if_empty(rootdir)
+def prune_empty_dirs(dirpaths, rootdir):
+    """Remove those of dirpaths which are empty, and then their ancestors as far up as
+    rootdir, stopping at the first which isn't empty, rather than walking the whole tree.
+    Return the number of directories removed."""
+    rootdir = os.path.normpath(rootdir)
+    n = 0
+    for dirpath in dirpaths:
+        dirpath = os.path.normpath(dirpath)
+        while dirpath == rootdir or dirpath.startswith(rootdir + os.sep):
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                # non-empty, or already gone, so its ancestors are no concern of ours
+                break
+            n += 1
+            if dirpath == rootdir:
+                break
+            dirpath = os.path.dirname(dirpath)
+    return n
 
 def path_splitall(path):
     xs = []
@@ -110,3 +208,22 @@ def force_makedirs(path, exist_ok=True, verbose=False):
             if verbose:
                 sys.stdout.write('removing file %s to create directory %s\n' % (e.filename, path))
             os.remove(badpath)
+
+def unescape_mountinfo(s):
+    """Decode the octal escapes used in mountinfo for space, tab, newline and backslash."""
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), s)
+
+def read_mount_points(mountinfo_path):
+    """Return the set of mount points listed in a mountinfo file, such as /proc/self/mountinfo."""
+    with open(mountinfo_path) as f:
+        return set(unescape_mountinfo(line.split()[4]) for line in f)
+
+def ismount_with_timeout(path, timeout):
+    """Return os.path.ismount(path), or None if it didn't complete within timeout seconds,
+    as may happen for a hung NFS server.  In that case the check is left running in a
+    daemon thread, which can't be cancelled."""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(os.path.ismount(path)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return result[0] if result else None
@@ -43,5 +43,8 @@ setup(name='automount-log-collator',
           'pytoml',
           'setuptools',
       ],
+      extras_require={
+          'export': ['numpy'],
+      },
       python_requires='>=3',
      )